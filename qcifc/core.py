@@ -1,16 +1,30 @@
 """Abstract interface to QM codes"""
 import abc
 from collections import deque
+from concurrent.futures import Future
 from fractions import Fraction
+import functools
+import glob
+import hashlib
 import math
+import os
 
 import numpy as np
 import scipy
+import scipy.linalg
+import scipy.sparse.linalg
 
 from . import normalizer
+from .subspace import Subspace
 
 SMALL = 1e-10
 
+#: Bound in bytes of the blocks of unit vectors in explicit E2/S2 builds
+E2S2_CHUNK_BYTES = 1 << 26
+
+#: Number of frequencies from which the direct solver diagonalizes the pencil
+PENCIL_FREQUENCIES = 20
+
 
 class Observer(abc.ABC):
     @abc.abstractmethod
@@ -49,17 +63,200 @@ class OutputStream(Observer):
         return f"\033[32m{text}\033[00m"
 
 
+class Preconditioner(abc.ABC):
+    """
+    Approximate inverse of E2 - w*S2 applied to residuals, forming new
+    trial vectors in lr_solve and pp_solve
+
+    Frequency dependent data are cached, see cached
+    """
+
+    cache_size = 64
+
+    def __init__(self, qc):
+        self.qc = qc
+        self._cache = {}
+
+    @abc.abstractmethod
+    def __call__(self, vector, w):
+        """Precondition a vector at frequency w"""
+
+    def cached(self, w, factory):
+        """
+        Cached factory(w), the cache is cleared when full as excitation
+        energies change in every iteration
+        """
+        key = (factory.__name__, w)
+        if key not in self._cache:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[key] = factory(w)
+        return self._cache[key]
+
+
+class DiagonalPreconditioner(Preconditioner):
+    """
+    Division by the diagonal od - w*sd, or its absolute value for
+    a positive definite preconditioner
+    """
+
+    def __init__(self, qc, shift=.0001, absolute=False):
+        super().__init__(qc)
+        self.od = qc.get_orbital_diagonal(shift=shift)
+        self.sd = qc.get_overlap_diagonal()
+        self.absolute = absolute
+
+    def denominator(self, w):
+        d = self.od - w*self.sd
+        return abs(d) if self.absolute else d
+
+    def __call__(self, vector, w):
+        return vector/self.cached(w, self.denominator)
+
+
+class LevelShiftPreconditioner(DiagonalPreconditioner):
+    """
+    Division by the diagonal od - w*sd, with denominators smaller than
+    level_shift in magnitude replaced by +-level_shift
+
+    Protects against near-zero denominators close to resonances
+    """
+
+    def __init__(self, qc, level_shift=0.05, shift=.0001):
+        super().__init__(qc, shift=shift)
+        self.level_shift = level_shift
+
+    def denominator(self, w):
+        d = super().denominator(w)
+        small = abs(d) < self.level_shift
+        d[small] = np.where(d[small] < 0, -1, 1)*self.level_shift
+        return d
+
+
+class TwoLevelPreconditioner(DiagonalPreconditioner):
+    """
+    Diagonal preconditioner with an explicit model of E2 - w*S2 for the
+    size excitations of lowest orbital diagonal and their de-excitations
+
+    The model is built once, with size linear transformations, and LU
+    factored per frequency. With tda=True the coupling of excitations and
+    de-excitations is left out of the model (Tamm-Dancoff).
+
+    The up-front linear transformations are rarely recovered within one
+    lr_solve: the saving per solve is at most a few tens of linear
+    transformations, and only when the coupling is concentrated among the
+    modeled excitations. Build the preconditioner once and pass it to
+    several lr_solve calls, e.g. a frequency scan, to amortize the model.
+    """
+
+    def __init__(self, qc, size=50, tda=False, shift=.0001):
+        super().__init__(qc, shift=shift)
+        n = len(self.od)//2
+        size = min(size, n)
+        excitations = np.sort(np.argpartition(self.od[:n], size - 1)[:size])
+        self.model = np.concatenate((excitations, excitations + n))
+        E2, S2 = qc._get_E2S2(excitations)
+        if tda:
+            for M in (E2, S2):
+                M[:size, size:] = 0
+                M[size:, :size] = 0
+        self.E2 = E2 + shift*np.eye(2*size)
+        self.S2 = S2
+
+    def factor(self, w):
+        return scipy.linalg.lu_factor(self.E2 - w*self.S2)
+
+    def __call__(self, vector, w):
+        t = super().__call__(vector, w)
+        t[self.model] = scipy.linalg.lu_solve(
+            self.cached(w, self.factor), vector[self.model]
+        )
+        return t
+
+
+class BlockDiagonalPreconditioner(Preconditioner):
+    """
+    Inverse of a Fock matrix model of E2 - w*S2, block diagonal over
+    occupied orbitals
+
+    For occupied i the block of excitations i->a, i->b is
+    2*(F_ab - F_ii*delta_ab) - w*S2_aa*delta_ab, with the MO Fock matrix
+    of get_mo_fock. For canonical orbitals this is the diagonal
+    preconditioner.
+    """
+
+    def __init__(self, qc, shift=.0001):
+        super().__init__(qc)
+        F = qc.get_mo_fock()
+        self.sd = qc.get_overlap_diagonal()
+        excitations = list(qc.get_excitations())
+        n = len(excitations)
+        self.blocks = []
+        for i in dict.fromkeys(i for i, _ in excitations):
+            k = np.array([j for j, (o, _) in enumerate(excitations) if o == i])
+            a = [excitations[j][1] for j in k]
+            M = 2*(F[np.ix_(a, a)] - F[i, i]*np.eye(len(a)))
+            M += shift*np.eye(len(a))
+            # X and Y parts have the same blocks
+            self.blocks.extend([(k, M), (k + n, M)])
+
+    def inverses(self, w):
+        return [
+            np.linalg.inv(M - w*np.diag(self.sd[k])) for k, M in self.blocks
+        ]
+
+    def __call__(self, vector, w):
+        result = np.zeros(len(vector))
+        for (k, _), inverse in zip(self.blocks, self.cached(w, self.inverses)):
+            result[k] = inverse@vector[k]
+        return result
+
+
 class QuantumChemistry(abc.ABC):
     """Abstract factory"""
 
     def setup(self, **kwargs):
         for k, v in kwargs.items():
             setattr(self, k, v)
-        self.set_normalizer(normalizer.Lowdin())
+        self.set_normalizer(normalizer.BlockGramSchmidt())
+        self.set_executor(None)
+        self._s2_diagonal = None
 
-    def set_normalizer(self, nzr):
+    def set_normalizer(self, nzr, **kwargs):
+        """
+        Normalizer of trial vectors, an instance or a name in
+        normalizer.normalizers with keyword arguments
+        """
+        if isinstance(nzr, str):
+            nzr = normalizer.normalizers[nzr](**kwargs)
         self.normalizer = nzr
 
+    def set_executor(self, executor):
+        """
+        Executor (concurrent.futures) running linear transformations,
+        None for sequential evaluation
+
+        With a process pool the object is pickled with each submitted
+        transformation, see __getstate__
+        """
+        self.executor = executor
+
+    def __getstate__(self):
+        """
+        State for pickling, without the executor which cannot be pickled
+        """
+        state = self.__dict__.copy()
+        state['executor'] = None
+        return state
+
+    def _submit(self, fn, *args):
+        executor = getattr(self, 'executor', None)
+        if executor is None:
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+        return executor.submit(fn, *args)
+
     def is_master(self):
         return True
 
@@ -91,6 +288,9 @@ class QuantumChemistry(abc.ABC):
 
     def cleanup_scf(self):
         """Clean-up after scf calculation"""
+        pattern = os.path.join(self.get_workdir(), 'E2S2_*.npz')
+        for filename in glob.glob(pattern):
+            os.remove(filename)
 
     def _set_densities(self, *das):
         """Set densities"""
@@ -118,10 +318,14 @@ class QuantumChemistry(abc.ABC):
         return ig
 
     def init_trials(
-        self, vectors, excitations=[], td=None, b=None, renormalize=True
+        self, vectors, excitations=[], td=None, b=None, renormalize=True,
+        paired=False, extra=None
     ):
         """
         Set up initial trial vectors from a set of intial guesses
+
+        Additional trial vectors, e.g. of an earlier subspace, are given as
+        columns of extra and included with their swapped images
         """
         trials = []
         for (op, freq) in vectors:
@@ -132,88 +336,323 @@ class QuantumChemistry(abc.ABC):
                 v = vec
             if np.linalg.norm(v) > SMALL:
                 trials.append(v)
-                if freq > SMALL:
+                if freq > SMALL and not paired:
                     trials.append(swap(v))
 
         for w, X in excitations:
             trials.append(X)
-            trials.append(swap(X))
+            if not paired:
+                trials.append(swap(X))
+
+        if extra is not None:
+            for t in np.asarray(extra).T:
+                trials.append(t)
+                if not paired:
+                    trials.append(swap(t))
 
         new_trials = np.array(trials).T
-        if b is not None:
-            new_trials = new_trials - b@b.T@new_trials
         if trials and renormalize:
-            # truncated = truncate(new_trials)
-            new_trials = self.normalizer.normalize(new_trials)
+            return self.orthonormalize_trials(new_trials, b, paired)
+        if b is not None:
+            new_trials = normalizer.project(b, new_trials)
         return new_trials
 
     def setup_trials(
-        self, vectors, excitations=[], converged={}, td=None, tdx=None, b=None,
-        renormalize=True
+        self, vectors, excitations=[], converged={}, preconditioner=None,
+        b=None, renormalize=True, paired=False, locked=()
     ):
         """
         Set up initial trial vectors from a set of intial guesses
+
+        The vectors are preconditioned, if given a Preconditioner, at their
+        frequencies or excitation energies.
+
+        Locked eigenvectors X, given with S2*X, and their swapped images
+        are projected out of the excitation trials
         """
+        def deflate(t):
+            for Xl, S2Xl in locked:
+                t = t - Xl*(S2Xl@t) - swap(Xl)*(swap(S2Xl)@t)
+            return t
+
         trials = []
         for (op, freq) in vectors:
             if converged[(op, freq)]:
                 continue
             vec = vectors[(op, freq)]
-            if td is not None:
-                v = vec/td[freq]
+            if preconditioner is not None:
+                v = preconditioner(vec, freq)
             else:
                 v = vec
             if np.linalg.norm(v) > SMALL:
                 trials.append(v)
-                if freq > SMALL:
+                if freq > SMALL and not paired:
                     trials.append(swap(v))
 
         for k, (w, X) in enumerate(excitations):
             if converged[k]:
                 continue
-            if tdx:
-                trials.append(X/tdx[w])
+            if preconditioner is not None:
+                t = preconditioner(X, w)
             else:
-                trials.append(X)
-            trials.append(swap(X))
+                t = X
+            trials.append(deflate(t))
+            if not paired:
+                trials.append(deflate(swap(X)))
 
         new_trials = np.array(trials).T
-        if b is not None:
-            new_trials = new_trials - b@b.T@new_trials
         if trials and renormalize:
-            truncated = truncate(new_trials)
-            new_trials = lowdin_normalize(truncated)
+            return self.orthonormalize_trials(new_trials, b, paired)
+        if b is not None:
+            new_trials = normalizer.project(b, new_trials)
         return new_trials
 
-    def pp_solve(self, roots, threshold=1e-5):
+    def orthonormalize_trials(self, new_trials, b, paired=False):
+        """
+        Orthogonalize new trials against b and normalize, with the normalizer
+
+        In paired mode the trials are split in gerade and ungerade parts,
+        swap(g) = g and swap(u) = -u, which are orthonormalized separately.
+        The swapped images are then contained in the span of the trials.
+        """
+        if paired:
+            blocks = ((1, new_trials + swap(new_trials)),
+                      (-1, new_trials - swap(new_trials)))
+        else:
+            blocks = ((0, new_trials),)
+        normalized = []
+        for sign, block in blocks:
+            if sign:
+                block = block[:, np.linalg.norm(block, axis=0) > SMALL]
+                if not block.shape[1]:
+                    continue
+            block = self.normalizer.orthonormalize(block, b)
+            if sign:
+                # remove round-off contamination of the opposite symmetry
+                block = (block + sign*swap(block))/2
+            normalized.append(block)
+        return np.hstack(normalized)
+
+    def is_s2_diagonal(self):
+        """
+        True if S2 is diagonal in the excitation basis, as for SCF states
+
+        Probed once by comparing a general S2 transformation of a random
+        vector with the overlap diagonal
+        """
+        if getattr(self, '_s2_diagonal', None) is None:
+            sd = self.get_overlap_diagonal()
+            probe = np.random.default_rng(0).random(len(sd))
+            s2n = self.s2n(probe[:, np.newaxis])[:, 0]
+            self._s2_diagonal = np.allclose(
+                s2n, sd*probe, rtol=1e-8, atol=SMALL*np.linalg.norm(probe)
+            )
+        return self._s2_diagonal
+
+    def s2n_block(self, trials):
+        """
+        S2 linear transformation of a block of trial vectors
+
+        For a diagonal S2 an element-wise multiplication of the whole block,
+        otherwise the general s2n of the backend
+        """
+        if self.is_s2_diagonal():
+            return self.get_overlap_diagonal()[:, np.newaxis]*trials
+        return self.s2n(trials)
+
+    def sigmas(self, trials, paired=False):
+        """
+        Linear transformations E2*b and S2*b of a block of trial vectors
+
+        In paired mode a gerade and an ungerade trial are transformed together
+        as one vector. Since E2 commutes and S2 anticommutes with swap,
+        the two contributions are separated by symmetry, which halves the
+        number of linear transformations.
+        """
+        return self.submit_sigmas(trials, paired)()
+
+    def submit_sigmas(self, trials, paired=False):
+        """
+        Start the linear transformations of trial vectors (see sigmas)
+
+        E2 and S2 transformations are submitted to the executor and run
+        concurrently. Returns a function waiting for the results.
+        """
+        # probe S2 before any concurrent use
+        diagonal = self.is_s2_diagonal()
+        if not paired:
+            e = self._submit(self.e2n, trials)
+            s = self._submit(self.s2n_block, trials)
+            return lambda: (e.result(), s.result())
+
+        p = parity(trials)
+        gerade, = np.where(p == 1)
+        ungerade, = np.where(p == -1)
+        mixed, = np.where(p == 0)
+        ng, nu, nm = len(gerade), len(ungerade), len(mixed)
+        npair = max(ng, nu)
+
+        combined = np.zeros((trials.shape[0], npair + nm))
+        combined[:, :ng] += trials[:, gerade]
+        combined[:, :nu] += trials[:, ungerade]
+        combined[:, npair:] = trials[:, mixed]
+
+        e = self._submit(self.e2n, combined)
+        if diagonal:
+            s = self._submit(self.s2n_block, trials)
+        else:
+            s = self._submit(self.s2n, combined)
+
+        def result():
+            se = swap(e.result()[:, :npair])
+            e2b = np.zeros(trials.shape)
+            e2b[:, gerade] = ((e.result()[:, :npair] + se)/2)[:, :ng]
+            e2b[:, ungerade] = ((e.result()[:, :npair] - se)/2)[:, :nu]
+            e2b[:, mixed] = e.result()[:, npair:]
+
+            if diagonal:
+                return e2b, s.result()
+
+            ss = swap(s.result()[:, :npair])
+            s2b = np.zeros(trials.shape)
+            s2b[:, gerade] = ((s.result()[:, :npair] - ss)/2)[:, :ng]
+            s2b[:, ungerade] = ((s.result()[:, :npair] + ss)/2)[:, :nu]
+            s2b[:, mixed] = s.result()[:, npair:]
+            return e2b, s2b
+
+        return result
+
+    def pp_solve(self, roots, threshold=1e-5, **kwargs):
         _, excitations = self.lr_solve(
-            ops=(), freqs=(), roots=roots, threshold=threshold
+            ops=(), freqs=(), roots=roots, threshold=threshold, **kwargs
         )
         return excitations
 
     def lr_solve(
-        self, ops="xyz", freqs=(0,), maxit=25, threshold=1e-5, roots=0
+        self, ops="xyz", freqs=(0,), maxit=25, threshold=1e-5, roots=0,
+        diagonalize=False, paired=False, max_subspace=None, checkpoint=None,
+        checkpoint_interval=1, out_of_core=False, single_precision=False,
+        method='davidson', preconditioner=None, guess=None, subspace=None
     ):
+        """
+        Solve linear response equations and/or the lowest excitation roots
+
+        With diagonalize=True the reduced pencil (E2, S2) is diagonalized
+        once per iteration and the solutions for all operators and
+        frequencies follow by back-substitution
+
+        With paired=True trial vectors are stored once, split in gerade and
+        ungerade parts, and their swapped images are implicit. Linear
+        transformations are evaluated for half as many vectors.
+
+        Linear transformations run on the executor set by set_executor,
+        concurrently with each other and with the subspace bookkeeping.
+
+        With max_subspace the subspace never grows beyond this number of
+        trial vectors. When new trials would not fit it is collapsed,
+        without new linear transformations, keeping by priority the
+        unconverged solutions and eigenvectors, the reduced eigenvectors of
+        roots up to the highest unconverged frequency and the first above,
+        converged solutions, previous iterates and the latest trials, as
+        many as fit. A ValueError is raised if the unconverged solutions and
+        eigenvectors together with their new trials cannot fit. Close to
+        a resonance max_subspace should also leave room for the eigenvectors
+        of all roots below the frequency, twice as many with paired, or
+        convergence stalls.
+
+        Converged solutions and roots are locked: they are not updated
+        in later iterations, and locked eigenvectors are deflated from new
+        trial vectors.
+
+        With checkpoint, a file name in the work directory, the subspace is
+        saved every checkpoint_interval iterations and when the solver
+        stops. A later call restarts from an existing
+        checkpoint of the same SCF state without new linear transformations.
+
+        With out_of_core=True trial vectors and their linear transformations
+        are kept in memory-mapped files in the work directory.
+
+        With single_precision=True they are stored in single precision,
+        the reduced equations are solved in double precision. Converged
+        residuals are verified with linear transformations of the full
+        precision solutions.
+
+        With method 'cg', 'minres' or 'gmres' the equations are instead
+        solved one at a time with a Krylov solver, see krylov_solve.
+
+        Residuals are preconditioned with preconditioner, by default
+        a DiagonalPreconditioner.
+
+        A warm start is given by guess, the (solutions, excitations) of
+        a previous lr_solve, see apply_guess, and/or subspace, previous
+        trial vectors as a Subspace or array of columns. They are
+        orthonormalized into the initial trial vectors.
+        """
+        if method != 'davidson':
+            if roots:
+                raise ValueError(f'{method} does not solve for excitations')
+            solutions = self.krylov_solve(
+                ops, freqs, method, maxit, threshold, preconditioner
+            )
+            return solutions, []
+        if preconditioner is None:
+            preconditioner = DiagonalPreconditioner(self)
 
         V1 = {op: v for op, v in zip(ops, self.get_rhs(*ops))}
         solutions = self.initial_guess(ops=ops, freqs=freqs)
         excitations = self.initial_excitations(roots)
-
-        b = self.init_trials(solutions, excitations)
-        # if the set of trial vectors is null we return the initial guess
-        if not np.any(b):
-            return solutions, excitations
-        e2b = self.e2n(b)
-        s2b = self.s2n(b)
-
-        od = self.get_orbital_diagonal(shift=.0001)
-        sd = self.get_overlap_diagonal()
-        td = {w: od - w*sd for w in freqs}
+        if guess is not None:
+            self.apply_guess(solutions, excitations, guess)
+        previous_trials = None
+        if subspace is not None:
+            if isinstance(subspace, Subspace):
+                previous_trials = np.array(subspace.b, dtype=float)
+            else:
+                previous_trials = np.asarray(subspace, dtype=float)
+            dim = len(self.get_overlap_diagonal())
+            if len(previous_trials) == dim:
+                previous_trials = previous_trials.reshape(dim, -1)
+            else:
+                previous_trials = None
+
+        storage = self.get_workdir() if out_of_core else None
+        dtype = np.float32 if single_precision else np.float64
+        if checkpoint:
+            checkpoint = os.path.join(self.get_workdir(), checkpoint)
+        reduced_space = self.load_checkpoint(checkpoint, V1, storage)
+        if reduced_space is None:
+            b = self.init_trials(
+                solutions, excitations, paired=paired, extra=previous_trials
+            )
+            # if the set of trial vectors is null we return the initial guess
+            if not np.any(b):
+                return solutions, excitations[:roots]
+            if max_subspace and b.shape[1] > max_subspace:
+                raise ValueError(
+                    f'{b.shape[1]} initial trials exceed '
+                    f'max_subspace={max_subspace}'
+                )
+            # linear transformations of the trials as stored
+            b = b.astype(dtype).astype(float)
+            reduced_space = Subspace(
+                len(b), capacity=max_subspace or 16, rhs=V1,
+                storage=storage, dtype=dtype
+            )
+            reduced_space.append(
+                b, *self.sigmas(b, paired),
+                parity=parity(b) if paired else None
+            )
+        # degenerate initial excitations span the initial subspace only
+        excitations = excitations[:roots]
 
         residuals = {}
         exresiduals = [None]*roots
+        reduced = {}
+        previous = {}
         relative_residual_norm = {}
         converged = {}
+        output = {}
+        locked = {}
 
         self.update_observers([], info='It')
         for op, freq in solutions:
@@ -224,13 +663,39 @@ class QuantumChemistry(abc.ABC):
         self.reset_observers()
 
         for i in range(maxit):
+            E2, S2 = reduced_space.E2, reduced_space.S2
+            active = [key for key in solutions if not converged.get(key)]
+            active_roots = [k for k in range(roots) if not converged.get(k)]
+            eigen = None
+            if diagonalize and (active or active_roots):
+                eigen = pencil(E2, S2)
+            if eigen is not None:
+                active_freqs = list(dict.fromkeys(freq for _, freq in active))
+                pencil_solutions = dict(zip(
+                    active_freqs,
+                    pencil_solve(*eigen, reduced_space.Vr, active_freqs)
+                ))
             # next solution
             self.update_observers([], info=f'{i+1}')
             for op, freq in solutions:
+                if converged.get((op, freq)):
+                    # locked, report the final values
+                    self.update_observers(output[(op, freq)], converged=True)
+                    continue
                 v = V1[op]
-                reduced_solution = np.linalg.solve(b.T@(e2b-freq*s2b), b.T@v)
-                solutions[(op, freq)] = b@reduced_solution
-                residuals[(op, freq)] = (e2b - freq*s2b)@reduced_solution - v
+                if eigen is not None:
+                    reduced_solution = \
+                        pencil_solutions[freq][:, reduced_space.ops[op]]
+                else:
+                    reduced_solution = np.linalg.solve(
+                        E2 - freq*S2, reduced_space.reduced_rhs(op)
+                    )
+                if (op, freq) in reduced:
+                    previous[(op, freq)] = reduced[(op, freq)]
+                reduced[(op, freq)] = reduced_solution
+                n, e2n, s2n = reduced_space.combine(reduced_solution)
+                solutions[(op, freq)] = n
+                residuals[(op, freq)] = e2n - freq*s2n - v
 
                 r = residuals[(op, freq)]
                 n = solutions[(op, freq)]
@@ -241,86 +706,451 @@ class QuantumChemistry(abc.ABC):
 
                 relative_residual_norm[(op, freq)] = rn / nn
                 converged[(op, freq)] = rn / nn < threshold
+                if converged[(op, freq)]:
+                    previous.pop((op, freq), None)
+                output[(op, freq)] = [nv, rn, nn]
                 self.update_observers(
                     [nv, rn, nn],
                     converged=converged[(op, freq)]
                 )
 
-            if roots > 0:
-                reduced_ev = self.direct_ev_solver2(roots, b.T@e2b, b.T@s2b)
-                for k, (w, reduced_X) in enumerate(reduced_ev):
-                    r = (e2b - w*s2b)@reduced_X
-                    X = b@reduced_X
-                    rn = np.linalg.norm(r)
-                    xn = np.linalg.norm(X)
-                    exresiduals[k] = (w, r)
-                    excitations[k] = (w, X)
-                    relative_residual_norm[k] = rn/xn
-                    converged[k] = rn/xn < threshold
-                    self.update_observers([w, rn, xn], converged=converged[k])
-
-            self.update_observers([], info=f'({len(b.T)})')
+            if active_roots:
+                if eigen is not None:
+                    reduced_ev = pencil_roots(*eigen, roots)
+                else:
+                    reduced_ev = self.direct_ev_solver2(
+                        roots, E2, S2, reduced_space.parity if paired else None
+                    )
+            else:
+                reduced_ev = [(None, None)]*roots
+            for k, (w, reduced_X) in enumerate(reduced_ev):
+                if converged.get(k):
+                    self.update_observers(output[k], converged=True)
+                    continue
+                X, e2X, s2X = reduced_space.combine(reduced_X)
+                r = e2X - w*s2X
+                if k in reduced:
+                    previous[k] = reduced[k]
+                reduced[k] = reduced_X
+                rn = np.linalg.norm(r)
+                xn = np.linalg.norm(X)
+                exresiduals[k] = (w, r)
+                excitations[k] = (w, X)
+                relative_residual_norm[k] = rn/xn
+                converged[k] = rn/xn < threshold
+                if converged[k]:
+                    locked[k] = (X, s2X)
+                    previous.pop(k, None)
+                output[k] = [w, rn, xn]
+                self.update_observers([w, rn, xn], converged=converged[k])
+
+            self.update_observers([], info=f'({len(reduced_space)})')
             self.reset_observers()
 
+            if single_precision and \
+                    max(relative_residual_norm.values()) < threshold:
+                self.refine_residuals(
+                    solutions, excitations, V1, residuals, exresiduals,
+                    relative_residual_norm
+                )
+                for key, norm in relative_residual_norm.items():
+                    converged[key] = norm < threshold
+                    if not converged[key]:
+                        locked.pop(key, None)
+
             if max(relative_residual_norm.values()) < threshold:
                 print("Converged")
                 break
 
-            tdx = {w: od-w*sd for w, _ in excitations}
             new_trials = self.setup_trials(
-                residuals, exresiduals, converged, td=td, tdx=tdx, b=b
+                residuals, exresiduals, converged,
+                preconditioner=preconditioner, b=reduced_space, paired=paired,
+                locked=locked.values()
             )
-            b = bappend(b, new_trials)
-            e2b = bappend(e2b, self.e2n(new_trials))
-            s2b = bappend(s2b, self.s2n(new_trials))
+            if single_precision:
+                new_trials = new_trials.astype(dtype).astype(float)
+            unconverged = [key for key in reduced if not converged.get(key)]
+            if max_subspace:
+                # gerade and ungerade parts are kept separately
+                required = (2 if paired else 1)*len(unconverged) + \
+                    new_trials.shape[1]
+                if required > max_subspace:
+                    raise ValueError(
+                        f'{len(unconverged)} unconverged solutions and '
+                        f'{new_trials.shape[1]} new trials exceed '
+                        f'max_subspace={max_subspace}'
+                    )
+            # bookkeeping below overlaps with the linear transformations
+            new_sigmas = self.submit_sigmas(new_trials, paired)
+            if max_subspace and \
+                    len(reduced_space) + new_trials.shape[1] > max_subspace:
+                reduced, previous = self.collapse(
+                    reduced_space, reduced, previous, unconverged,
+                    max_subspace - new_trials.shape[1], paired
+                )
+            reduced_space.add_trials(
+                new_trials, parity=parity(new_trials) if paired else None
+            )
+            reduced_space.add_sigmas(*new_sigmas())
+
+            if checkpoint and (i + 1) % checkpoint_interval == 0:
+                self.save_checkpoint(checkpoint, reduced_space)
+
+        if checkpoint:
+            self.save_checkpoint(checkpoint, reduced_space)
 
         return solutions, excitations
 
-    def direct_lr_solver(self, ops="xyz", freqs=(0.), **kwargs):
+    def collapse(self, subspace, reduced, previous, active, size, paired):
+        """
+        Collapse the subspace of lr_solve to at most size vectors
+
+        In order of priority: the active (unconverged) reduced solutions,
+        reduced eigenvectors of roots up to the highest active frequency
+        and the first above, other reduced solutions, previous iterates and
+        the latest trials. Returns the reduced solutions and the previous
+        iterates which remain in the collapsed subspace, in its coordinates.
+        """
+        dim = len(subspace)
+
+        def padded(c):
+            return np.pad(c, (0, dim - len(c)))
+
+        frequencies = [key[1] for key in active if isinstance(key, tuple)]
+        ritz = []
+        if frequencies:
+            # the general solver leaves unphysical roots unnormalized
+            with np.errstate(invalid='ignore'):
+                roots = list(self.direct_ev_solver2(
+                    dim//2, subspace.E2, subspace.S2,
+                    subspace.parity if paired else None
+                ))
+            for w, x in roots:
+                if not np.all(np.isfinite(x)):
+                    break
+                ritz.append(x)
+                if w > max(frequencies):
+                    break
+
+        others = [key for key in reduced if key not in active]
+        vectors = np.array(
+            [padded(reduced[key]) for key in active] + ritz +
+            [padded(reduced[key]) for key in others] +
+            [padded(c) for c in previous.values()]
+        ).T
+        Q = subspace.collapse(vectors, max_size=size)
+        # reduced coordinates in the collapsed basis, and what is lost
+        collapsed = Q.T@vectors
+        lost = np.linalg.norm(vectors - Q@collapsed, axis=0) / \
+            np.maximum(np.linalg.norm(vectors, axis=0), SMALL)
+        columns = range(len(active), len(active) + len(ritz))
+        collapsed = np.delete(collapsed, columns, 1)
+        lost = np.delete(lost, columns)
+
+        n = len(reduced)
+        reduced = dict(zip(active + others, collapsed.T[:n]))
+        # previous iterates are only kept if they are still in the subspace
+        previous = {
+            key: c
+            for key, c, loss in zip(previous, collapsed.T[n:], lost[n:])
+            if loss < 1e-8
+        }
+        return reduced, previous
+
+    def apply_guess(self, solutions, excitations, guess):
+        """
+        Replace initial vectors with those of a previous lr_solve,
+        guess = (solutions, excitations)
+
+        A solution is taken for the same operator at the nearest frequency,
+        excitations in order. Vectors of another dimension, vanishing or
+        not finite are skipped, keeping the default.
+        """
+        previous_solutions, previous_excitations = guess
+        dim = len(self.get_overlap_diagonal())
+
+        def usable(v):
+            v = np.asarray(v, dtype=float)
+            return v.shape == (dim,) and np.all(np.isfinite(v)) and np.any(v)
+
+        for op, freq in solutions:
+            candidates = [
+                (abs(f - freq), v) for (o, f), v in previous_solutions.items()
+                if o == op and usable(v)
+            ]
+            if candidates:
+                _, v = min(candidates, key=lambda c: c[0])
+                solutions[(op, freq)] = np.array(v, dtype=float)
+        for k, (w, X) in enumerate(previous_excitations):
+            if k < len(excitations) and usable(X):
+                excitations[k] = (w, np.array(X, dtype=float))
+
+    def krylov_solve(
+        self, ops="xyz", freqs=(0,), method='cg', maxit=25, threshold=1e-5,
+        preconditioner=None
+    ):
+        """
+        Solve linear response equations with a Krylov solver
+
+        The solvers of scipy.sparse.linalg run one right-hand side at a time
+        from the diagonal initial guess, preconditioned with preconditioner,
+        by default the diagonal od - w*sd. Only a few vectors are stored.
+
+        cg needs a positive definite E2 - w*S2, i.e. frequencies below
+        the first excitation energy. At w = 0 the gerade and ungerade parts
+        are solved separately as half-size (A + B) and (A - B) problems.
+        minres applies to all frequencies and needs a positive definite
+        preconditioner, by default the absolute diagonal. gmres is
+        restarted, maxit counts restarts.
+
+        The solvers test their own, possibly preconditioned, residual norm.
+        The true residual is checked and a solver is restarted with
+        a tightened tolerance if needed.
+        """
+        if method not in ('cg', 'minres', 'gmres'):
+            raise ValueError(f'Unknown method {method}')
+        solver = getattr(scipy.sparse.linalg, method)
+        LinearOperator = scipy.sparse.linalg.LinearOperator
+        kwargs = {'restart': 20} if method == 'gmres' else {}
+
+        def solve(A, M, v, x):
+            # stop at relative residual threshold w.r.t. the solution norm
+            rtol = threshold*np.linalg.norm(x)/np.linalg.norm(v)
+            for _ in range(3):
+                x, _ = solver(
+                    A, v, x0=x, rtol=rtol, maxiter=maxit, M=M, **kwargs
+                )
+                rn = np.linalg.norm(A.matvec(x) - v)
+                if rn < threshold*np.linalg.norm(x):
+                    break
+                rtol *= threshold*np.linalg.norm(x)/rn
+            return x
+
         V1 = {op: v for op, v in zip(ops, self.get_rhs(*ops))}
-        E2, S2 = self._get_E2S2()
+        solutions = self.initial_guess(ops=ops, freqs=freqs)
+        if preconditioner is None:
+            preconditioner = DiagonalPreconditioner(
+                self, absolute=(method == 'minres')
+            )
+        dim = len(self.get_overlap_diagonal())
+        half = dim//2
+
+        for (op, freq), guess in solutions.items():
+            v = V1[op]
+            if not np.any(v):
+                continue
+
+            if method == 'cg' and abs(freq) < SMALL:
+                solution = np.zeros(dim)
+                for sign in (1, -1):
+                    rhs = (v + sign*swap(v))[:half]/2
+                    if np.linalg.norm(rhs) < SMALL:
+                        continue
+                    x0 = (guess + sign*swap(guess))[:half]/2
+
+                    def matvec(z, sign=sign):
+                        z = np.append(z, sign*z)[:, np.newaxis]
+                        return self.e2n(z)[:half, 0]
+
+                    def psolve(z, sign=sign):
+                        return preconditioner(np.append(z, sign*z), 0)[:half]
+
+                    z = solve(
+                        LinearOperator((half, half), matvec=matvec),
+                        LinearOperator((half, half), matvec=psolve),
+                        rhs, x0
+                    )
+                    solution += np.append(z, sign*z)
+                solutions[(op, freq)] = solution
+                continue
+
+            def matvec(x, freq=freq):
+                x = x[:, np.newaxis]
+                e2x = self.e2n(x)
+                if freq:
+                    e2x = e2x - freq*self.s2n_block(x)
+                return e2x[:, 0]
+
+            def psolve(x, freq=freq):
+                return preconditioner(x, freq)
+
+            solutions[(op, freq)] = solve(
+                LinearOperator((dim, dim), matvec=matvec),
+                LinearOperator((dim, dim), matvec=psolve),
+                v, guess
+            )
+        return solutions
+
+    def refine_residuals(
+        self, solutions, excitations, V1, residuals, exresiduals, norms
+    ):
+        """
+        Recompute residuals and relative residual norms of lr_solve with
+        linear transformations of the solutions and eigenvectors
+        """
+        vectors = list(solutions.values()) + [X for _, X in excitations]
+        e2n, s2n = self.sigmas(np.array(vectors).T)
+        for j, (op, freq) in enumerate(solutions):
+            r = e2n[:, j] - freq*s2n[:, j] - V1[op]
+            residuals[(op, freq)] = r
+            norms[(op, freq)] = np.linalg.norm(r)/np.linalg.norm(vectors[j])
+        for k, (w, X) in enumerate(excitations):
+            j = len(solutions) + k
+            r = e2n[:, j] - w*s2n[:, j]
+            exresiduals[k] = (w, r)
+            norms[k] = np.linalg.norm(r)/np.linalg.norm(X)
+
+    def save_checkpoint(self, filename, subspace):
+        """
+        Save the subspace of lr_solve, with the orbital diagonal identifying
+        the SCF state
+        """
+        subspace.save(filename, orbital_diagonal=self.get_orbital_diagonal())
+
+    def load_checkpoint(self, filename, rhs, storage=None):
+        """
+        Restore a subspace saved by lr_solve
+
+        Returns None if there is no checkpoint or if it belongs to
+        a different SCF state
+        """
+        if not filename or not os.path.exists(filename):
+            return None
+        subspace, arrays = Subspace.load(filename, rhs=rhs, storage=storage)
+        od = self.get_orbital_diagonal()
+        saved = arrays['orbital_diagonal']
+        if saved.shape != od.shape or not np.allclose(saved, od):
+            return None
+        return subspace
+
+    def direct_lr_solver(
+        self, ops="xyz", freqs=(0.), diagonalize=None, **kwargs
+    ):
+        X = self.direct_lr_tensor(ops, freqs, diagonalize)
         solutions = {
-            (op, freq): np.linalg.solve((E2-freq*S2), V1[op])
-            for freq in freqs for op in ops
+            (op, freq): X[i, k]
+            for i, freq in enumerate(np.atleast_1d(freqs).tolist())
+            for k, op in enumerate(ops)
         }
         return solutions
 
-    def direct_ev_solver(self, n_states, E2=None, S2=None):
-        if E2 is None or S2 is None:
-            E2, S2 = self._get_E2S2()
-        wn, Xn = np.linalg.eigh((np.linalg.solve(S2, E2)))
-        p = wn.argsort()
-        wn = wn[p]
-        Xn = Xn[:, p]
+    def direct_lr_tensor(self, ops="xyz", freqs=(0.), diagonalize=None):
+        """
+        Solutions of the linear response equations for all operators and
+        frequencies, an array of shape (len(freqs), len(ops), dim)
+
+        E2 - w*S2 is LU factored once per frequency and solved for all
+        operators as one block. With diagonalize, by default for at least
+        PENCIL_FREQUENCIES frequencies, the pencil (E2, S2) is instead
+        diagonalized once, unless E2 is not positive definite.
+        """
+        freqs = np.atleast_1d(np.asarray(freqs, dtype=float))
+        E2, S2 = self._get_E2S2()
         dim = len(E2)
-        lo = dim//2
-        hi = dim//2 + n_states
-        for i in range(lo, hi):
-            norm = np.sqrt(Xn[:, i].T@S2@Xn[:, i])
-            Xn[:, i] /= norm
-        return zip(wn[lo: hi], Xn[:, lo: hi].T)
+        V = np.reshape(self.get_rhs(*ops), (len(ops), dim)).T
+        if diagonalize is None:
+            diagonalize = len(freqs) >= PENCIL_FREQUENCIES
+        eigen = pencil(E2, S2) if diagonalize else None
+        if eigen is not None:
+            mu, Z = eigen
+            ZV = Z.T@V
+            X = Z@(ZV/(1 - np.multiply.outer(freqs, mu))[:, :, np.newaxis])
+        else:
+            X = np.empty((len(freqs), dim, len(ops)))
+            for i, w in enumerate(freqs):
+                lu = scipy.linalg.lu_factor(E2 - w*S2)
+                X[i] = scipy.linalg.lu_solve(lu, V)
+        return X.transpose(0, 2, 1)
 
-    def direct_ev_solver2(self, n_states, E2=None, S2=None):
+    def direct_ev_solver(self, n_states, E2=None, S2=None):
+        """
+        Lowest excitation energies and S2-normalized eigenvectors,
+        see direct_ev_solver2
+        """
+        return self.direct_ev_solver2(n_states, E2, S2)
+
+    def direct_ev_solver2(self, n_states, E2=None, S2=None, parity=None):
+        """
+        Lowest excitation energies and S2-normalized eigenvectors
+
+        The structured solvers rpa_eigensolver, or paired_rpa_eigensolver
+        given parity labels of a paired reduced basis, are tried first,
+        with a general eigensolver as fallback
+        """
         if E2 is None or S2 is None:
             E2, S2 = self._get_E2S2()
+        if parity is None:
+            roots = rpa_eigensolver(E2, S2, n_states)
+        else:
+            roots = paired_rpa_eigensolver(E2, S2, parity, n_states)
+        if roots is not None:
+            wn, Xn = roots
+            return zip(wn, Xn.T)
         E2 = (E2 + E2.T)/2
         S2 = (S2 + S2.T)/2
         T = np.linalg.solve(E2, S2)
         wn, Xn = np.linalg.eig(T)
         p = list(reversed(wn.argsort()))
-        wn = wn[p]
-        Xn = Xn[:, p]
+        # physical roots are real, drop zero imaginary parts
+        wn = wn[p].real
+        Xn = Xn[:, p].real
         for i in range(n_states):
             norm = np.sqrt(Xn[:, i].T@S2@Xn[:, i])
             Xn[:, i] /= norm
         return zip(1/wn[:n_states], Xn[:, :n_states].T)
 
-    def _get_E2S2(self):
+    def _get_E2S2(self, excitations=None):
+        """
+        Explicit E2 and S2
+
+        With excitations, indices of the X part, the blocks of these
+        excitations and their de-excitations. Only the excitation columns
+        are transformed, in blocks of at most E2S2_CHUNK_BYTES, the
+        de-excitation columns follow from swap symmetry, P*E2*P = E2 and
+        P*S2*P = -S2
+
+        The full matrices are cached in the work directory, keyed by
+        scf_fingerprint
+        """
+        if excitations is None:
+            filename = os.path.join(
+                self.get_workdir(), f'E2S2_{self.scf_fingerprint()}.npz'
+            )
+            if os.path.exists(filename):
+                with np.load(filename) as data:
+                    return data['E2'], data['S2']
+            n = len(list(self.get_excitations()))
+            E2, S2 = self._get_E2S2(np.arange(n))
+            with open(filename, 'wb') as f:
+                np.savez(f, E2=E2, S2=S2)
+            return E2, S2
+
         dim = 2*len(list(self.get_excitations()))
-        E2 = self.e2n(np.eye(dim))
-        S2 = self.s2n(np.eye(dim))
+        excitations = np.asarray(excitations, dtype=int)
+        m = len(excitations)
+        k = np.concatenate((excitations, excitations + dim//2))
+        E2 = np.empty((2*m, 2*m))
+        S2 = np.empty((2*m, 2*m))
+        chunk = max(1, E2S2_CHUNK_BYTES // (8*dim))
+        for start in range(0, m, chunk):
+            columns = np.arange(start, min(start + chunk, m))
+            units = np.zeros((dim, len(columns)))
+            units[excitations[columns], np.arange(len(columns))] = 1
+            e2 = self.e2n(units)
+            s2 = self.s2n_block(units)
+            E2[:, columns] = e2[k]
+            E2[:, columns + m] = swap(e2)[k]
+            S2[:, columns] = s2[k]
+            S2[:, columns + m] = -swap(s2)[k]
         return E2, S2
 
+    def scf_fingerprint(self):
+        """
+        Short hash identifying the SCF state, from the orbital diagonal
+        """
+        od = np.ascontiguousarray(self.get_orbital_diagonal(), dtype=float)
+        return hashlib.sha1(od.tobytes()).hexdigest()[:16]
+
     def lr(self, aops, bops, freqs=(0,), **kwargs):
         v1 = {op: v for op, v in zip(aops, self.get_rhs(*aops))}
         solutions, _ = self.lr_solve(bops, freqs, **kwargs)
@@ -330,18 +1160,25 @@ class QuantumChemistry(abc.ABC):
                 lrs[(aop, bop, w)] = -np.dot(v1[aop], solutions[(bop, w)])
         return lrs
 
-    def initial_excitations(self, n):
-        excitations = list(self.get_excitations())
-        excitation_energies = 0.5*self.get_orbital_diagonal()
-        w = {ia: w for ia, w in zip(excitations, excitation_energies)}
-        ordered_excitations = sorted(w, key=w.get)[:n]
-        final = []
-        for (i, a) in ordered_excitations:
-            ia = excitations.index((i, a))
-            Xn = np.zeros(2*len(excitations))
-            Xn[ia] = 1.0
-            final.append((w[(i, a)], Xn))
-        return final
+    def initial_excitations(self, n, degeneracy=1e-6):
+        """
+        Excitation energies, half the orbital diagonal, and unit vectors of
+        the n lowest excitations
+
+        Excitations within degeneracy of the n-th are included, so that
+        a degenerate set is not split, and more than n may be returned
+        """
+        w = 0.5*self.get_orbital_diagonal()
+        w = w[:len(w)//2]
+        n = min(n, len(w))
+        if n <= 0:
+            return []
+        lowest = np.argpartition(w, n - 1)[:n]
+        selected = np.flatnonzero(w <= w[lowest].max() + degeneracy)
+        selected = selected[np.argsort(w[selected], kind='stable')]
+        X = np.zeros((2*len(w), len(selected)))
+        X[selected, np.arange(len(selected))] = 1.0
+        return list(zip(w[selected], X.T))
 
     def transition_moments(self, ops, roots, **kwargs):
         solutions = list(self.pp_solve(roots, **kwargs))
@@ -370,6 +1207,20 @@ class QuantumChemistry(abc.ABC):
         return e, gn
 
 
+def per_iteration(method):
+    """
+    Memoize a method of an SCF iterator in its state, so that it is
+    evaluated once for the current MO coefficients
+    """
+    @functools.wraps(method)
+    def memoized(self):
+        key = method.__name__
+        if key not in self.state:
+            self.state[key] = method(self)
+        return self.state[key]
+    return memoized
+
+
 class SCFIterator():
     def __init__(self):
         self.energies = []
@@ -412,17 +1263,16 @@ class RoothanIterator(SCFIterator, abc.ABC):
         self.Z = None
         self.h1 = None
         self.S = None
-        self._Fa = None
-        self._Fb = None
-        self._Da = None
-        self._Db = None
-        self.ga = None
-        self.gb = None
         self.rohf_factors = kwargs.get('factors', (1.0, 1.0))
         self.kwargs = kwargs
         self.open_shells = kwargs.get('open_shells', [])
         self.frozen_orbitals = kwargs.get('frozen', [])
         self.loggers = kwargs.get('loggers', [])
+        self.orthogonalizer = kwargs.get('orthogonalizer', 'symmetric')
+        self.lindep = kwargs.get('lindep', 1e-8)
+        self.orthonormal = kwargs.get('orthonormal', False)
+        self.X = None
+        self.SI = None
 
         nel = kwargs.get('electrons', 0)
         na = (nel + 2*self.ms)//2
@@ -433,29 +1283,49 @@ class RoothanIterator(SCFIterator, abc.ABC):
             del(self.occb[self.occb.index(self.open_shells[0])])
             self.occb.append(nb)
 
+    @property
+    def C(self):
+        return self._C
+
+    @C.setter
+    def C(self, C):
+        """
+        New MO coefficients, discarding the state of the previous ones
+        """
+        self._C = C
+        self.state = {}
+
     @property
     def Da(self):
-        if self._Da is None:
+        if 'densities' not in self.state:
             self.set_densities()
-        return self._Da
+        return self.state['densities'][0]
 
     @property
     def Db(self):
-        if self._Db is None:
+        if 'densities' not in self.state:
             self.set_densities()
-        return self._Db
+        return self.state['densities'][1]
 
     @property
     def Fa(self):
-        if self._Fa is None:
+        if 'focks' not in self.state:
             self.set_focks()
-        return self._Fa
+        return self.state['focks'][0]
 
     @property
     def Fb(self):
-        if self._Fb is None:
+        if 'focks' not in self.state:
             self.set_focks()
-        return self._Fb
+        return self.state['focks'][1]
+
+    @property
+    def ga(self):
+        return self.gradients()[0]
+
+    @property
+    def gb(self):
+        return self.gradients()[1]
 
     @property
     def na(self):
@@ -481,7 +1351,8 @@ class RoothanIterator(SCFIterator, abc.ABC):
         self.Z = self.code.get_nuclear_repulsion()
         self.h1 = self.code.get_one_el_hamiltonian()
         self.S = self.code.get_overlap()
-        self.SI = np.linalg.inv(self.S)
+        self.X = orthogonalizer(self.S, self.orthogonalizer, self.lindep)
+        self.SI = self.X@self.X.T
 
         if self.C is None:
             self.generate_start_guess_mo()
@@ -494,8 +1365,6 @@ class RoothanIterator(SCFIterator, abc.ABC):
         """
         if not self.converged() and self.it < self.max_iterations:
             self.it += 1
-            self.set_densities()
-            self.set_focks()
             e = self.energy()
             gn = self.gn()
             self.energies.append(e)
@@ -507,12 +1376,15 @@ class RoothanIterator(SCFIterator, abc.ABC):
 
     def set_densities(self):
         Ca, Cb = self.C
-        self._Da = Ca[:, self.occa] @ Ca[:, self.occa].T
-        self._Db = Cb[:, self.occb] @ Cb[:, self.occb].T
+        self.state['densities'] = (
+            Ca[:, self.occa] @ Ca[:, self.occa].T,
+            Cb[:, self.occb] @ Cb[:, self.occb].T
+        )
 
     def set_focks(self):
-        (self._Fa, self._Fb), = self.code.get_two_el_fock((self.Da, self.Db))
+        self.state['focks'], = self.code.get_two_el_fock((self.Da, self.Db))
 
+    @per_iteration
     def energy(self):
         e1 = np.einsum('ij,ij', self.h1, (self.Da + self.Db))
         e2 = 0.5*(
@@ -532,20 +1404,37 @@ class RoothanIterator(SCFIterator, abc.ABC):
             raise Exception(f'Starting guess method "{method}" unknown')
 
     def h1diag(self):
-        l, V = scipy.linalg.eigh(self.h1, self.S)
+        l, V = self.diagonalize(self.h1)
         return V
 
-    def gn(self):
+    def diagonalize(self, F):
+        """
+        Orbital energies and coefficients of a Fock matrix
+
+        With orthonormal, a symmetric eigenproblem in the orthonormal basis
+        of the orthogonalizer X, without linearly dependent combinations,
+        otherwise the generalized eigenproblem F*C = S*C*l
+        """
+        if self.orthonormal:
+            l, V = np.linalg.eigh(self.X.T@F@self.X)
+            return l, self.X@V
+        return scipy.linalg.eigh(F, self.S)
+
+    @per_iteration
+    def gradients(self):
+        """
+        Commutator gradients SDF - FDS of the alpha and beta densities
+        """
         Fa = self.h1 + self.Fa
         Fb = self.h1 + self.Fb
         Da = self.Da
         Db = self.Db
         S = self.S
-        SI = np.linalg.inv(S)
-
-        self.ga = S@Da@Fa - Fa@Da@S
-        self.gb = S@Db@Fb - Fb@Db@S
+        return S@Da@Fa - Fa@Da@S, S@Db@Fb - Fb@Db@S
 
+    @per_iteration
+    def gn(self):
+        SI = self.SI
         g = self.ga + self.gb
 
         if self.frozen_orbitals:
@@ -561,7 +1450,7 @@ class RoothanIterator(SCFIterator, abc.ABC):
             return
 
         F = self.Feff()
-        l, V = scipy.linalg.eigh(F, self.S)
+        l, V = self.diagonalize(F)
         Ca = V
         Cb = Ca
         self.C = Ca, Cb
@@ -571,20 +1460,16 @@ class RoothanIterator(SCFIterator, abc.ABC):
         rhs[-1] = 1.0
         return np.linalg.solve(self.B(), rhs)[:-1]
 
+    @per_iteration
     def Feff(self):
 
         F = self.h1 + (self.Fa + self.Fb)/2
         S = self.S
-        SI = np.linalg.inv(S)
+        SI = self.SI
 
         Da = self.Da
         Db = self.Db
-        Fa = self.h1 + self.Fa
-        Fb = self.h1 + self.Fb
-
-        ga = S @ Da @ Fa - Fa @ Da @ S
-        gb = S @ Db @ Fb - Fb @ Db @ S
-        g = ga + gb
+        g = self.ga + self.gb
 
         inactive = Db
         active = Da - Db
@@ -632,18 +1517,22 @@ class RoothanIterator(SCFIterator, abc.ABC):
     def remove_beta(self, orb):
         if orb in self.occb:
             del self.occb[self.occb.index(orb)]
-            self._Da = self._Db = self._Fa = self._Fb = None
+            self.state = {}
             self.it = 0
             self.vecs.clear()
             self.evecs.clear()
+            self.errors = np.empty((0, 0))
         else:
             print("Warning: ignoring delete of non-occupied orbital {orb}")
 
     def converged(self):
+        """
+        Gradient norm of the latest iteration below threshold
+        """
         if self.it == 0:
             return False
         else:
-            return self.gn() < self.threshold
+            return self.gradient_norms[-1] < self.threshold
 
 
 class DiisIterator(RoothanIterator):
@@ -652,6 +1541,7 @@ class DiisIterator(RoothanIterator):
         super().__init__(*args, **kwargs)
         self.evecs = deque()
         self.vecs = deque()
+        self.errors = np.empty((0, 0))
         self.max_vecs = kwargs.get('max_vecs', 2)
 
     def __next__(self):
@@ -660,20 +1550,13 @@ class DiisIterator(RoothanIterator):
         """
         if not self.converged() and self.it < self.max_iterations:
             self.it += 1
-            self.set_densities()
-            self.set_focks()
             e = self.energy()
             gn = self.gn()
-
-            self.vecs.append(self.Feff())
-            self.evecs.append(self.ga + self.gb)
-            if len(self.vecs) > self.max_vecs:
-                self.vecs.popleft()
-                self.evecs.popleft()
-
-            self.update_mo()
             self.energies.append(e)
             self.gradient_norms.append(gn)
+
+            self.add_vectors(self.Feff(), self.ga + self.gb)
+            self.update_mo()
             return (e, gn)
         else:
             raise StopIteration
@@ -684,7 +1567,7 @@ class DiisIterator(RoothanIterator):
             return
 
         F = self.Fopt()
-        l, V = scipy.linalg.eigh(F, self.S)
+        l, V = self.diagonalize(F)
         for logger in self.loggers:
             logger.info(f"{self.it}," + ",".join(f'{e:10.5f}' for e in l))
         Ca = V
@@ -692,13 +1575,36 @@ class DiisIterator(RoothanIterator):
         # breakpoint()
         self.C = Ca, Cb
 
+    def add_vectors(self, F, g):
+        """
+        Store a Fock matrix and its error vector
+
+        Error vectors are stored in the orthonormal basis, X.T*g*X, where
+        the overlap of two of them, tr(gi*S^-1*gj*S^-1), is a plain inner
+        product. The overlap matrix errors is extended by one row and
+        column, and the oldest vectors are dropped beyond max_vecs.
+        """
+        e = self.X.T@g@self.X
+        k = len(self.evecs)
+        errors = np.empty((k + 1, k + 1))
+        errors[:k, :k] = self.errors
+        errors[k, :k] = errors[:k, k] = [
+            4*np.einsum('ij,ij', ei, e) for ei in self.evecs
+        ]
+        errors[k, k] = 4*np.einsum('ij,ij', e, e)
+
+        self.vecs.append(F)
+        self.evecs.append(e)
+        self.errors = errors
+        if len(self.vecs) > self.max_vecs:
+            self.vecs.popleft()
+            self.evecs.popleft()
+            self.errors = self.errors[1:, 1:]
+
     def B(self):
         dim = len(self.evecs) + 1
         Bmat = np.ones((dim, dim))
-        for i, vi in enumerate(self.evecs):
-            for j, vj in enumerate(self.evecs):
-                Bmat[i, j] = 4*np.einsum('ij,ij', vi, (self.SI@vj@self.SI))
-
+        Bmat[:-1, :-1] = self.errors
         Bmat[-1, -1] = 0
         return Bmat
 
@@ -730,28 +1636,141 @@ def swap(xy):
     return yx
 
 
-def bappend(b1, b2):
+def parity(b):
+    """
+    Symmetry of vectors under swap: 1 gerade, -1 ungerade, 0 neither
+    """
+    sb = swap(b)
+    norm = SMALL*np.linalg.norm(b, axis=0)
+    gerade = np.linalg.norm(b - sb, axis=0) <= norm
+    ungerade = np.linalg.norm(b + sb, axis=0) <= norm
+    return np.where(gerade, 1, np.where(ungerade, -1, 0))
+
+
+def pencil(E2, S2):
+    """
+    Diagonalize the response pencil (E2, S2)
+
+    Solves S2*z = mu*E2*z for positive definite E2 with z.T*E2*z = 1, so
+    that (E2 - w*S2)^-1 = Z*diag(1/(1 - w*mu))*Z.T for any frequency w.
+    Returns None if E2 is not positive definite.
+    """
+    E2 = (E2 + E2.T)/2
+    S2 = (S2 + S2.T)/2
+    try:
+        return scipy.linalg.eigh(S2, E2)
+    except np.linalg.LinAlgError:
+        return None
+
+
+def pencil_solve(mu, Z, V, freqs):
     """
-    Merge arrays by appending column-wise
+    Solve (E2 - w*S2)*X = V for a block of right-hand sides V
+    and all frequencies w from the pencil eigenvectors
     """
-    b12 = np.append(b1, b2, axis=1)
-    return b12
+    ZV = Z.T@V
+    return [Z@(ZV/(1 - w*mu)[:, np.newaxis]) for w in freqs]
 
 
-def truncate(basis, threshold=1e-10):
+def pencil_roots(mu, Z, n_states):
     """
-    Remove linear dependency in basis
-    - skip eigenvectors of small eigenvalues of overlap matrix
-    Returns truncated transformed basis
+    Lowest positive excitation energies w = 1/mu with S2-normalized vectors
     """
-    Sb = basis.T@basis
-    l, T = np.linalg.eigh(Sb)
-    b_norm = np.sqrt(Sb.diagonal())
-    mask = l > threshold*b_norm
-    return basis @ T[:, mask]
+    p = mu.argsort()[::-1][:n_states]
+    wn = 1/mu[p]
+    Xn = Z[:, p]*np.sqrt(wn)
+    return zip(wn, Xn.T)
 
 
-def lowdin_normalize(basis):
-    l, T = np.linalg.eigh(basis.T@basis)
-    inverse_sqrt = (T*np.sqrt(1/l)) @ T.T
-    return basis@inverse_sqrt
+def rpa_roots(Eg, Eu, Sgu, n_states):
+    """
+    Lowest roots of the RPA problem in gerade/ungerade form,
+    Eg*p = w*Sgu*q, Eu*q = w*Sgu.T*p
+
+    Eliminating q gives the symmetric half-size problem
+    Sgu*Eu^-1*Sgu.T*p = 1/w^2*Eg*p, of which only the n_states largest
+    eigenvalues are computed. Vectors are normalized to 2*p.T*Sgu*q = 1.
+    Raises LinAlgError unless Eg and Eu are positive definite and there
+    are n_states roots.
+    """
+    h = len(Eg)
+    if n_states > min(h, len(Eu)):
+        raise np.linalg.LinAlgError('Too few roots')
+    if n_states == 0:
+        return np.zeros(0), np.zeros((h, 0)), np.zeros((len(Eu), 0))
+    EuSgu = scipy.linalg.solve(Eu, Sgu.T, assume_a='pos')
+    M = Sgu@EuSgu
+    lam, P = scipy.linalg.eigh(
+        (M + M.T)/2, (Eg + Eg.T)/2, subset_by_index=[h - n_states, h - 1]
+    )
+    if lam[0] <= SMALL:
+        raise np.linalg.LinAlgError('Too few roots')
+    wn = 1/np.sqrt(lam[::-1])
+    P = P[:, ::-1]*np.sqrt(wn/2)
+    Q = wn*(EuSgu@P)
+    return wn, P, Q
+
+
+def rpa_eigensolver(E2, S2, n_states):
+    """
+    Lowest excitation energies and S2-normalized eigenvectors (columns)
+    for E2 = [[A, B], [B, A]] and S2 = [[Sigma, Delta], [-Delta, -Sigma]]
+
+    Solved as the half-size problem of rpa_roots with Eg = A + B,
+    Eu = A - B and Sgu = Sigma - Delta. Returns None if E2 and S2 lack
+    this structure or for an unstable E2.
+    """
+    n, odd = divmod(len(E2), 2)
+    if odd:
+        return None
+    A, B = E2[:n, :n], E2[:n, n:]
+    Sigma, Delta = S2[:n, :n], S2[:n, n:]
+    structured = (
+        np.allclose(E2, np.block([[A, B], [B, A]])) and
+        np.allclose(S2, np.block([[Sigma, Delta], [-Delta, -Sigma]]))
+    )
+    if not structured:
+        return None
+    try:
+        wn, P, Q = rpa_roots(A + B, A - B, Sigma - Delta, n_states)
+    except np.linalg.LinAlgError:
+        return None
+    return wn, np.vstack((P + Q, P - Q))/np.sqrt(2)
+
+
+def paired_rpa_eigensolver(E2, S2, parity, n_states):
+    """
+    As rpa_eigensolver for reduced matrices in a basis of gerade (parity 1)
+    and ungerade (parity -1) vectors, where E2 couples only equal and S2
+    only opposite parities
+    """
+    g, u = parity == 1, parity == -1
+    if not np.all(g | u):
+        return None
+    try:
+        wn, P, Q = rpa_roots(
+            E2[np.ix_(g, g)], E2[np.ix_(u, u)], S2[np.ix_(g, u)], n_states
+        )
+    except np.linalg.LinAlgError:
+        return None
+    X = np.zeros((len(parity), n_states))
+    X[g], X[u] = P, Q
+    return wn, X
+
+
+def orthogonalizer(S, method='symmetric', threshold=1e-8):
+    """
+    Orthogonalizer X of an overlap matrix, X.T*S*X = 1
+
+    symmetric: S^-1/2, canonical: U*s^-1/2 with eigenvectors U of S.
+    Eigenvectors of eigenvalues below threshold are removed, in which case
+    X is canonical with fewer columns than S.
+    """
+    if method not in ('symmetric', 'canonical'):
+        raise ValueError(f'Orthogonalizer "{method}" unknown')
+    s, U = np.linalg.eigh(S)
+    mask = s > threshold
+    X = U[:, mask]/np.sqrt(s[mask])
+    if method == 'symmetric' and mask.all():
+        return X@U.T
+    return X
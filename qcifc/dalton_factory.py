@@ -89,6 +89,10 @@ class DaltonFactory(QuantumChemistry):
             filename = os.path.join(self.get_workdir(), "SIRIFC")
         return sirifc.SirIfc(filename)
 
+    def get_mo_fock(self):
+        """Get Fock matrix in MO basis"""
+        return self._sirifc().fc.unblock()
+
     def get_orbital_diagonal(self, filename=None, shift=0.):
         ifc = self._sirifc()
         try:
@@ -199,6 +203,7 @@ class DaltonFactory(QuantumChemistry):
         subprocess.call(
             'rm *.[0-9] DALTON.* *AO* *SIR* *RSP* molden.inp', shell=True
         )
+        super().cleanup_scf()
 
 
 class DaltonFactoryDummy(DaltonFactory):
@@ -206,12 +211,14 @@ class DaltonFactoryDummy(DaltonFactory):
 
     def get_overlap_diagonal(self, filename=None):
         n = self.response_dim()
-        sd = np.array(
-            [
-                oli.s2n(c, tmpdir=self.get_workdir())
-                for c in np.eye(n)
-            ]
-        ).diagonal()
+        sd = np.zeros(n)
+        unit = np.zeros(n)
+        for j in range(n//2):
+            unit[j] = 1
+            sd[j] = oli.s2n(unit, tmpdir=self.get_workdir())[j]
+            unit[j] = 0
+        # de-excitations by swap symmetry, P*S2*P = -S2
+        sd[n//2:] = -sd[:n//2]
         return sd
 
     def lr_solve(self, ops="xyz", freqs=(0.), **kwargs):
@@ -1,6 +1,19 @@
 import abc
 
 import numpy as np
+import scipy.linalg
+
+from .subspace import Subspace
+
+
+def project(b, t):
+    """
+    Project t on the complement of the orthonormal columns b,
+    an array or a Subspace
+    """
+    if isinstance(b, Subspace):
+        return b.orthogonalize(t)
+    return t - b@(b.T@t)
 
 
 class Normalizer(abc.ABC):
@@ -12,6 +25,14 @@ class Normalizer(abc.ABC):
     def normalize(self, b):
         "Implements truncate and normalize"
 
+    def orthonormalize(self, basis, b=None):
+        """
+        Orthogonalize basis against orthonormal b, if given, and normalize
+        """
+        if b is not None:
+            basis = project(b, basis)
+        return self.normalize(basis)
+
 
 class Lowdin(Normalizer):
 
@@ -30,15 +51,16 @@ class GramSchmidt(Normalizer):
         Return Gram-Schmidt normalized basis
         """
 
-        new = basis[:, :1]/np.linalg.norm(basis[:, 0])
-
-        for column in basis.T[1:]:
-            column -= new @ (new.T @ column)
+        new = np.empty(basis.shape)
+        rank = 0
+        for column in basis.T:
+            q = new[:, :rank]
+            column = column - q @ (q.T @ column)
             norm = np.linalg.norm(column)
             if norm > self.threshold:
-                column /= norm
-                new = np.append(new, column.reshape((len(column), 1)), axis=1)
-        return new
+                new[:, rank] = column/norm
+                rank += 1
+        return new[:, :rank]
 
 
 class QR(Normalizer):
@@ -48,3 +70,103 @@ class QR(Normalizer):
         q, r = np.linalg.qr(basis)
         mask = np.max(np.abs(r), axis=1) > self.threshold
         return q[:, mask]
+
+
+class BlockGramSchmidt(Normalizer):
+    """
+    Two-pass block classical Gram-Schmidt (BCGS2)
+
+    A block is projected on the complement of an existing orthonormal basis
+    and orthonormalized within itself, twice. Each pass is a few matrix
+    products with the whole block, the second restores the orthogonality
+    lost to round-off in the first.
+
+    Columns are scaled to unit norm first, so that the threshold is relative.
+    Columns mostly in the span of the basis, and linear dependencies within
+    the block, are dropped.
+    """
+
+    def normalize(self, basis):
+        return self.orthonormalize(basis)
+
+    def orthonormalize(self, basis, b=None):
+        basis = np.asarray(basis, dtype=float)
+        norms = np.linalg.norm(basis, axis=0)
+        keep = norms > np.finfo(float).tiny
+        basis = basis[:, keep]/norms[keep]
+        for _ in range(2):
+            if b is not None:
+                basis = project(b, basis)
+            basis = self.intra(basis)
+        return basis
+
+    def intra(self, basis):
+        """
+        Orthonormalize a block by the eigenvectors of its Gram matrix,
+        skipping those of eigenvalues below threshold
+        """
+        if not basis.shape[1]:
+            return basis
+        l, T = np.linalg.eigh(basis.T@basis)
+        mask = l > self.threshold
+        return basis @ (T[:, mask]/np.sqrt(l[mask]))
+
+
+class CholeskyQR2(BlockGramSchmidt):
+    """
+    Cholesky QR, twice, within BCGS2
+
+    The block is orthonormalized as basis*inv(R) with R the Cholesky factor
+    of its Gram matrix, one matrix product and a triangular solve. The second
+    pass of BCGS2 restores the orthogonality lost in the first, for
+    well-conditioned blocks as good as Householder QR.
+
+    Should the factorization fail for an ill-conditioned block, the Gram
+    matrix is shifted slightly and the block is passed once more. Blocks
+    found rank deficient, with a small diagonal of R, are orthonormalized
+    by pivoted QR instead, dropping dependent columns.
+    """
+
+    def intra(self, basis):
+        m, n = basis.shape
+        if not n:
+            return basis
+        G = basis.T@basis
+        shifted = False
+        try:
+            L = np.linalg.cholesky(G)
+        except np.linalg.LinAlgError:
+            shift = 11*(m*n + n*(n + 1))*np.finfo(float).eps*np.trace(G)
+            try:
+                L = np.linalg.cholesky(G + shift*np.eye(n))
+            except np.linalg.LinAlgError:
+                return self.pivoted(basis)
+            shifted = True
+        if np.min(L.diagonal()) <= np.sqrt(self.threshold):
+            return self.pivoted(basis)
+        # basis*inv(R) as a matrix product, R = L.T
+        inverse = scipy.linalg.solve_triangular(L, np.eye(n), lower=True)
+        basis = basis @ inverse.T
+        if shifted:
+            # shifted Cholesky QR leaves the block only well-conditioned
+            return self.intra(basis)
+        return basis
+
+    def pivoted(self, basis):
+        """
+        Orthonormalize by QR with column pivoting, skipping columns with
+        a diagonal of R below threshold
+        """
+        q, r, _ = scipy.linalg.qr(basis, mode='economic', pivoting=True)
+        rank = int(np.sum(np.abs(r.diagonal()) > np.sqrt(self.threshold)))
+        return q[:, :rank]
+
+
+#: Normalizers by name, see QuantumChemistry.set_normalizer
+normalizers = {
+    'lowdin': Lowdin,
+    'gs': GramSchmidt,
+    'qr': QR,
+    'bcgs2': BlockGramSchmidt,
+    'cholqr2': CholeskyQR2,
+}
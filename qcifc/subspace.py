@@ -0,0 +1,331 @@
+"""Storage of trial vectors for iterative response solvers"""
+import os
+import tempfile
+
+import numpy as np
+
+#: Approximate size in bytes of the column panels in products with storage
+PANEL_BYTES = 1 << 21
+
+
+def panels(rows, end, start=0, itemsize=8):
+    """
+    Slices of columns start:end such that a panel of a rows x end array
+    is about PANEL_BYTES
+    """
+    width = max(1, PANEL_BYTES // (itemsize*max(rows, 1)))
+    for j in range(start, end, width):
+        yield slice(j, min(j + width, end))
+
+
+class Subspace:
+    """
+    Trial vectors b with linear transformations E2*b and S2*b
+
+    Columns are stored in preallocated arrays. When the capacity is exhausted
+    it is doubled, so that appending is amortized constant time per column.
+    The active columns are exposed as views, no copies are made.
+
+    The reduced matrices b.T*E2*b, b.T*S2*b and the projections b.T*V of
+    right-hand sides V are updated with new rows and columns only as
+    trials are appended.
+
+    Trials may be labeled by their symmetry under swap of the X and Y parts,
+    1 (gerade), -1 (ungerade) or 0 (neither). E2 couples only trials of
+    equal and S2 only trials of opposite symmetry, the corresponding blocks
+    of the reduced matrices are set to zero.
+
+    Trials can be added in two steps, add_trials and add_sigmas, so that
+    bookkeeping overlaps with the evaluation of linear transformations.
+
+    The subspace can be collapsed to a set of vectors within it, the linear
+    transformations follow by linear combination of stored columns.
+
+    The subspace can be saved to and loaded from a file for restarts.
+
+    With storage, a directory, the columns are kept in memory-mapped files
+    rather than in memory. Products with the stored columns are done in
+    column panels, see combine and orthogonalize, so that only a panel at
+    a time needs to be resident.
+
+    The columns may be stored in reduced precision, e.g. dtype=np.float32.
+    Products with them, and the reduced matrices, are in double precision.
+    """
+
+    def __init__(
+        self, dim, capacity=16, rhs=None, storage=None, dtype=np.float64
+    ):
+        self.dim = dim
+        self.size = 0
+        self.latest = slice(0, 0)
+        self.storage = storage
+        self.dtype = np.dtype(dtype)
+        self._b = self._allocate(capacity)
+        self._e2b = self._allocate(capacity)
+        self._s2b = self._allocate(capacity)
+        self._parity = np.zeros(capacity, dtype=int)
+        self._E2 = np.empty((capacity, capacity))
+        self._S2 = np.empty((capacity, capacity))
+        rhs = rhs or {}
+        self.ops = {op: k for k, op in enumerate(rhs)}
+        self.V = np.array(list(rhs.values())).reshape((len(rhs), dim)).T
+        self._Vr = np.empty((capacity, len(rhs)))
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return self._b.shape[1]
+
+    @property
+    def b(self):
+        return self._b[:, :self.size]
+
+    @property
+    def e2b(self):
+        return self._e2b[:, :self.size]
+
+    @property
+    def s2b(self):
+        return self._s2b[:, :self.size]
+
+    @property
+    def parity(self):
+        return self._parity[:self.size]
+
+    @property
+    def E2(self):
+        """Reduced E2 matrix"""
+        return self._E2[:self.size, :self.size]
+
+    @property
+    def S2(self):
+        """Reduced S2 matrix"""
+        return self._S2[:self.size, :self.size]
+
+    @property
+    def Vr(self):
+        """Projections of all right-hand sides"""
+        return self._Vr[:self.size]
+
+    def reduced_rhs(self, op):
+        """Projection of right-hand side on the subspace"""
+        return self._Vr[:self.size, self.ops[op]]
+
+    def reserve(self, columns):
+        """
+        Make room for at least a given number of columns
+        """
+        if columns <= self.capacity:
+            return
+        capacity = max(columns, 2*self.capacity)
+        self._b = self._grow(self._b, capacity)
+        self._e2b = self._grow(self._e2b, capacity)
+        self._s2b = self._grow(self._s2b, capacity)
+        parity = np.zeros(capacity, dtype=int)
+        parity[:self.size] = self._parity[:self.size]
+        self._parity = parity
+        self._E2 = self._grow_reduced(self._E2, capacity)
+        self._S2 = self._grow_reduced(self._S2, capacity)
+        Vr = np.empty((capacity, self._Vr.shape[1]))
+        Vr[:self.size] = self._Vr[:self.size]
+        self._Vr = Vr
+
+    def _allocate(self, capacity):
+        if self.storage is None:
+            return np.empty((self.dim, capacity), dtype=self.dtype, order='F')
+        fd, filename = tempfile.mkstemp(
+            prefix='subspace_', suffix='.dat', dir=self.storage
+        )
+        os.close(fd)
+        array = np.memmap(
+            filename, dtype=self.dtype, mode='w+', shape=(self.dim, capacity),
+            order='F'
+        )
+        # the mapping outlives the file name, the file is released with it
+        os.remove(filename)
+        return array
+
+    def _grow(self, array, capacity):
+        new = self._allocate(capacity)
+        for p in self._panels(self.size):
+            new[:, p] = array[:, p]
+        return new
+
+    def _panels(self, end, start=0):
+        return panels(self.dim, end, start, self.dtype.itemsize)
+
+    def _grow_reduced(self, array, capacity):
+        new = np.empty((capacity, capacity))
+        new[:self.size, :self.size] = array[:self.size, :self.size]
+        return new
+
+    def append(self, b, e2b, s2b, parity=None):
+        """
+        Add new trial vectors and their linear transformations
+        """
+        self.add_trials(b, parity)
+        self.add_sigmas(e2b, s2b)
+
+    def add_trials(self, b, parity=None):
+        """
+        Add new trial vectors, to be completed by add_sigmas
+
+        The parts of the reduced matrices which do not depend on the new
+        linear transformations are updated, which can overlap with their
+        evaluation
+        """
+        b = np.asarray(b, dtype=float)
+        columns = b.shape[1]
+        start, end = self.size, self.size + columns
+        self.reserve(end)
+        self._b[:, start:end] = b
+        self._parity[start:end] = 0 if parity is None else parity
+
+        for full, reduced in ((self._e2b, self._E2), (self._s2b, self._S2)):
+            for p in self._panels(start):
+                reduced[start:end, p] = b.T @ full[:, p]
+        self._Vr[start:end] = b.T @ self.V
+        self.latest = slice(start, end)
+
+    def add_sigmas(self, e2b, s2b):
+        """
+        Add linear transformations of the trials from add_trials
+        """
+        start, end = self.latest.start, self.latest.stop
+        self._e2b[:, start:end] = e2b
+        self._s2b[:, start:end] = s2b
+
+        for new, reduced in ((e2b, self._E2), (s2b, self._S2)):
+            for p in self._panels(end):
+                reduced[p, start:end] = self._b[:, p].T @ new
+
+        parity = self._parity[:end]
+        pp = np.outer(parity, parity[start:end])
+        self._E2[:end, start:end][pp == -1] = 0
+        self._E2[start:end, :end][pp.T == -1] = 0
+        self._S2[:end, start:end][pp == 1] = 0
+        self._S2[start:end, :end][pp.T == 1] = 0
+        self.size = end
+
+    def collapse(self, vectors, threshold=1e-10, max_size=None):
+        """
+        Restrict the subspace to given vectors and the latest trials
+
+        The vectors are given as reduced coordinates (columns) in the current
+        basis, in order of priority, followed by the latest trials. They are
+        orthonormalized in this order, skipping linearly dependent ones,
+        and with max_size only the first max_size basis vectors are kept.
+        For labeled trials the vectors are split by symmetry.
+        Returns the transformation Q from old to new basis, b <- b*Q.
+        """
+        vectors = np.hstack((
+            np.reshape(vectors, (self.size, -1)),
+            np.eye(self.size)[:, self.latest]
+        ))
+        parity = self.parity
+        if parity.all():
+            columns = [
+                (p, v*(parity == p)) for v in vectors.T for p in (1, -1)
+            ]
+        else:
+            columns = [(0, v) for v in vectors.T]
+        scale = max(1, np.max(np.sum(vectors**2, axis=0), initial=0))
+
+        blocks, labels = [], []
+        for p, v in columns:
+            if max_size is not None and len(blocks) >= max_size:
+                break
+            same = np.array([q for q, l in zip(blocks, labels) if l == p])
+            if len(same):
+                # classical Gram-Schmidt, reorthogonalized once
+                for _ in range(2):
+                    v = v - same.T@(same@v)
+            norm2 = v@v
+            if norm2 > threshold*scale:
+                blocks.append(v/np.sqrt(norm2))
+                labels.append(p)
+        Q = np.array(blocks).reshape(-1, self.size).T
+        size = Q.shape[1]
+
+        # rows transform independently, in place in panels of rows
+        height = max(1, PANEL_BYTES // (self.dtype.itemsize*self.size))
+        for array in (self._b, self._e2b, self._s2b):
+            for i in range(0, self.dim, height):
+                rows = slice(i, i + height)
+                array[rows, :size] = array[rows, :self.size]@Q
+        for array in (self._E2, self._S2):
+            array[:size, :size] = Q.T@array[:self.size, :self.size]@Q
+        self._Vr[:size] = Q.T@self._Vr[:self.size]
+        self._parity[:size] = labels
+
+        pp = np.outer(labels, labels)
+        self._E2[:size, :size][pp == -1] = 0
+        self._S2[:size, :size][pp == 1] = 0
+        self.size = size
+        self.latest = slice(0, 0)
+        return Q
+
+    def combine(self, x):
+        """
+        Linear combinations b*x, E2*b*x and S2*b*x of the stored columns
+        """
+        x = np.asarray(x)
+        results = [np.zeros((self.dim,) + x.shape[1:]) for _ in range(3)]
+        for p in self._panels(self.size):
+            for result, full in zip(results, (self._b, self._e2b, self._s2b)):
+                result += full[:, p] @ x[p]
+        return tuple(results)
+
+    def orthogonalize(self, t):
+        """
+        Remove the components of t in the span of the trials, t - b*b.T*t
+        """
+        t = np.array(t, dtype=float)
+        columns = list(self._panels(self.size))
+        coefficients = [self._b[:, p].T @ t for p in columns]
+        for p, c in zip(columns, coefficients):
+            t -= self._b[:, p] @ c
+        return t
+
+    def save(self, filename, **arrays):
+        """
+        Write the subspace, with optional additional arrays, to a npz file
+
+        The file is replaced atomically so that an interrupted write leaves
+        the previous checkpoint intact
+        """
+        tmp = f'{filename}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(
+                f, b=self.b, e2b=self.e2b, s2b=self.s2b, parity=self.parity,
+                E2=self.E2, S2=self.S2, **arrays
+            )
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename, rhs=None, storage=None):
+        """
+        Read a subspace saved with save
+
+        Projections of right-hand sides are formed from the stored trials.
+        Returns the subspace and a dictionary of additional arrays.
+        """
+        with np.load(filename) as data:
+            arrays = {k: data[k] for k in data.files}
+        b = arrays.pop('b')
+        dim, size = b.shape
+        subspace = cls(
+            dim, capacity=max(size, 16), rhs=rhs, storage=storage,
+            dtype=b.dtype
+        )
+        subspace._b[:, :size] = b
+        subspace._e2b[:, :size] = arrays.pop('e2b')
+        subspace._s2b[:, :size] = arrays.pop('s2b')
+        subspace._parity[:size] = arrays.pop('parity')
+        subspace._E2[:size, :size] = arrays.pop('E2')
+        subspace._S2[:size, :size] = arrays.pop('S2')
+        subspace._Vr[:size] = b.T @ subspace.V
+        subspace.size = size
+        return subspace, arrays
@@ -222,6 +222,10 @@ class VeloxChem(QuantumChemistry):
         s2d[lz:] = -2.0
         return s2d
 
+    def is_s2_diagonal(self):
+        """S2 is diagonal for a closed-shell SCF reference"""
+        return self.task.molecule.get_multiplicity() == 1
+
     def get_rhs(self, *args):
         """
         Create right-hand sides of linear response equations
@@ -287,6 +291,12 @@ class VeloxChem(QuantumChemistry):
             self._fock = (fa, fb)
         return self._fock
 
+    def get_mo_fock(self):
+        """Get alpha Fock matrix in MO basis"""
+        mo = self.get_mo()
+        fa, _ = self.get_fock()
+        return mo.T @ fa @ mo
+
     def e2n(self, vecs):
         vecs = np.array(vecs)
 
@@ -0,0 +1,92 @@
+"""
+Benchmark of the trial vector normalizers
+
+Times each normalizer on tall-skinny blocks shaped like trial sets, with
+controlled rank deficiency, and reports time, peak memory and the loss of
+orthogonality max|Q.T*Q - 1|. Not collected by pytest, run as
+
+    python tests/bench_ortho.py [--rows ...] [--columns ...] [--rank ...]
+
+or with make bench.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from qcifc.normalizer import normalizers
+
+
+def random_rank(m, n, k, seed=0):
+    """
+    Random m x n block of rank k, the last n - k columns are linear
+    combinations of the first k
+    """
+    rng = np.random.default_rng(seed)
+    a = np.empty((m, n))
+    a[:, :k] = rng.random((m, k))
+    a[:, k:] = a[:, :k] @ rng.random((k, n - k))
+    return a
+
+
+def measure(normalizer, basis, repeat=3):
+    """
+    Best time, peak memory in bytes, rank and loss of orthogonality
+    of normalizer on basis
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        q = normalizer.normalize(basis)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    q = normalizer.normalize(basis)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    loss = np.max(np.abs(q.T@q - np.eye(q.shape[1]))) if q.size else 0.
+    return min(times), peak, q.shape[1], loss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--rows', type=int, nargs='+', default=[10_000, 100_000]
+    )
+    parser.add_argument(
+        '--columns', type=int, nargs='+', default=[1, 10, 50, 200]
+    )
+    parser.add_argument(
+        '--rank', type=float, nargs='+', default=[1.0, 0.5],
+        help='rank as a fraction of the number of columns'
+    )
+    parser.add_argument(
+        '--normalizers', nargs='+', default=list(normalizers),
+        choices=list(normalizers)
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(
+        f'{"normalizer":>10} {"rows":>8} {"cols":>5} {"rank":>5} '
+        f'{"found":>5} {"time/s":>9} {"peak/MB":>9} {"loss":>9}'
+    )
+    for m in args.rows:
+        for n in args.columns:
+            ranks = {max(1, round(f*n)) for f in args.rank}
+            for k in sorted(ranks, reverse=True):
+                basis = random_rank(m, n, k)
+                for name in args.normalizers:
+                    t, peak, found, loss = measure(
+                        normalizers[name](), basis, args.repeat
+                    )
+                    print(
+                        f'{name:>10} {m:8d} {n:5d} {k:5d} {found:5d} '
+                        f'{t:9.4f} {peak/2**20:9.1f} {loss:9.1e}'
+                    )
+
+
+if __name__ == '__main__':
+    main()
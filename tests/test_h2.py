@@ -1,4 +1,6 @@
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import pytest
 import numpy as np
 import pandas as pd
@@ -206,6 +208,12 @@ class TestH2(TestQC):
         n, s2n = trials
         npt.assert_allclose(code.s2n(n), s2n, atol=1e-8)
 
+    def test_s2_diagonal(self, code):
+        assert code.is_s2_diagonal()
+        npt.assert_allclose(
+            code.s2n_block(np.eye(2)), code.s2n(np.eye(2)), atol=1e-8
+        )
+
     def test_sli_error(self, code):
         with pytest.raises(TypeError):
             code.s2n([[[]]])
@@ -366,17 +374,39 @@ class TestH2(TestQC):
         ],
         ids=['x-0', 'z-0', 'z-0.5', 'z-(0, 0.5)']
     )
-    def test_solve(self, code, args):
+    @pytest.mark.parametrize('diagonalize', [False, True])
+    @pytest.mark.parametrize('paired', [False, True])
+    def test_solve(self, code, args, diagonalize, paired):
         self.skip_if_not_implemented('lr_solve', code)
 
         ops, freqs, expected = args
-        solutions, _ = code.lr_solve(ops=ops, freqs=freqs)
+        solutions, _ = code.lr_solve(
+            ops=ops, freqs=freqs, diagonalize=diagonalize, paired=paired
+        )
         for op, freq in solutions:
             npt.assert_allclose(
                 solutions[(op, freq)],
                 expected[(op, freq)]
             )
 
+    def test_solve_executor(self, code):
+        self.skip_if_not_implemented('lr_solve', code)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            code.set_executor(executor)
+            solutions, _ = code.lr_solve(ops='z', freqs=(0.5,))
+        code.set_executor(None)
+        npt.assert_allclose(solutions[('z', 0.5)], [1.91230027, -0.40322064])
+
+    def test_solve_process_executor(self, code):
+        self.skip_if_not_implemented('lr_solve', code)
+
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            code.set_executor(executor)
+            solutions, _ = code.lr_solve(ops='z', freqs=(0.5,))
+        code.set_executor(None)
+        npt.assert_allclose(solutions[('z', 0.5)], [1.91230027, -0.40322064])
+
     @pytest.mark.parametrize(
         'args',
         [
@@ -508,6 +538,45 @@ class TestH2(TestQC):
         assert final_norm < 1e-5
         assert final_energy == pytest.approx(-0.5382054446)
 
+    def test_roothan_state(self, code):
+        code.set_roothan_iterator(
+            code,
+            electrons=2,
+            max_iterations=10,
+            threshold=1e-5,
+            tmpdir=code.get_workdir(),
+        )
+        it = iter(code.roothan)
+        it.gn()
+        assert {'densities', 'focks', 'gradients', 'gn'} <= set(it.state)
+        F = it.Feff()
+        assert it.Feff() is F
+        it.C = it.C
+        assert it.state == {}
+
+    @pytest.mark.parametrize('orthogonalizer', ['symmetric', 'canonical'])
+    @pytest.mark.parametrize(
+        'electrons, ms, expected',
+        [(2, 0, -1.116759309042810), (1, 1/2, -0.5382054446)],
+        ids=['rhf', 'rohf']
+    )
+    def test_roothan_orthonormal(
+        self, code, orthogonalizer, electrons, ms, expected
+    ):
+        code.set_roothan_iterator(
+            'h2',
+            electrons=electrons,
+            max_iterations=10,
+            threshold=1e-5,
+            tmpdir=code.get_workdir(),
+            ms=ms,
+            orthonormal=True,
+            orthogonalizer=orthogonalizer,
+        )
+        final_energy, final_norm = code.run_roothan_iterations()
+        assert final_norm < 1e-5
+        assert final_energy == pytest.approx(expected)
+
     def test_first_roothan_rohf(self, code):
         code.set_roothan_iterator(
             'h2',
@@ -1,7 +1,15 @@
+import os
+
 import pytest
 import numpy as np
 import numpy.testing as npt
 
+from qcifc.core import (
+    OutputStream, DiagonalPreconditioner, LevelShiftPreconditioner,
+    BlockDiagonalPreconditioner, TwoLevelPreconditioner
+)
+from qcifc.subspace import Subspace
+
 from . import TestQC, get_codes_settings, get_codes_ids
 
 CASE = 'h2o'
@@ -58,12 +66,217 @@ class TestH2O(TestQC):
         for k, v in lr.items():
             npt.assert_allclose(v, expected[k], atol=1e-4)
 
+    @pytest.mark.parametrize('method', ['cg', 'minres', 'gmres'])
+    @pytest.mark.parametrize(
+        'freq, expected',
+        [(0, -4.980329678152), (0.2, -5.518828539302)],
+        ids=['0', '0.2']
+    )
+    def test_lr_krylov(self, code, method, freq, expected):
+        lr = code.lr('z', 'z', (freq,), method=method)
+        npt.assert_allclose(lr[('z', 'z', freq)], expected, atol=1e-4)
+
+    def test_lr_krylov_excitations(self, code):
+        with pytest.raises(ValueError):
+            code.lr_solve('z', (0,), roots=1, method='cg')
+
+    @pytest.mark.parametrize(
+        'preconditioner',
+        [
+            DiagonalPreconditioner,
+            LevelShiftPreconditioner,
+            BlockDiagonalPreconditioner,
+            TwoLevelPreconditioner,
+            lambda code: TwoLevelPreconditioner(code, size=10, tda=True),
+        ],
+        ids=['diagonal', 'level-shift', 'block-diagonal', 'two-level', 'tda']
+    )
+    def test_lr_preconditioner(self, code, preconditioner):
+        self.skip_if_not_implemented('get_mo_fock', code)
+
+        preconditioner = preconditioner(code)
+        self.assert_lr_and_excitations(code, preconditioner=preconditioner)
+        # the given preconditioner replaces the default one
+        assert preconditioner._cache
+
+    def test_e2s2_model(self, code):
+        E2, S2 = code._get_E2S2()
+        n = len(E2)//2
+        excitations = [0, 3, 5]
+        k = [0, 3, 5, n, n + 3, n + 5]
+        e2, s2 = code._get_E2S2(excitations)
+        npt.assert_allclose(e2, E2[np.ix_(k, k)], atol=1e-8)
+        npt.assert_allclose(s2, S2[np.ix_(k, k)], atol=1e-8)
+
+    def test_e2s2_cached(self, code):
+        E2, S2 = code._get_E2S2()
+        cache = os.path.join(
+            code.get_workdir(), f'E2S2_{code.scf_fingerprint()}.npz'
+        )
+        assert os.path.exists(cache)
+        e2, s2 = code._get_E2S2()
+        npt.assert_allclose(e2, E2)
+        npt.assert_allclose(s2, S2)
+        code.cleanup_scf()
+        assert not os.path.exists(cache)
+
+    @pytest.mark.parametrize('diagonalize', [False, True])
+    def test_direct_lr_tensor(self, code, diagonalize):
+        X = code.direct_lr_tensor('xyz', [0, 0.2], diagonalize=diagonalize)
+        V = np.array(code.get_rhs('x', 'y', 'z'))
+        assert X.shape == (2, 3, V.shape[1])
+        lr = -np.einsum('bi,wai->wab', V, X)
+        npt.assert_allclose(
+            lr.diagonal(axis1=1, axis2=2),
+            [
+                [-3.046547105763, -6.591935043775, -4.980329678152],
+                [-3.495340131306, -7.226826515191, -5.518828539302],
+            ],
+            atol=1e-4
+        )
+
+    def test_lr_max_subspace(self, code):
+        output = []
+        code.set_observer(OutputStream(output.append, 10))
+        lr = code.lr('xyz', 'xyz', (0.2,), max_subspace=12)
+        npt.assert_allclose(lr[('x', 'x', 0.2)], -3.495340131306, atol=1e-4)
+        npt.assert_allclose(lr[('y', 'y', 0.2)], -7.226826515191, atol=1e-4)
+        npt.assert_allclose(lr[('z', 'z', 0.2)], -5.518828539302, atol=1e-4)
+        # subspace dimensions are reported as (n)
+        dims = [
+            int(item.strip()[1:-1])
+            for item in output if item.strip().startswith('(')
+        ]
+        assert dims and max(dims) <= 12
+
+    def test_lr_max_subspace_too_small(self, code):
+        self.skip_if_not_implemented('lr_solve', code)
+        with pytest.raises(ValueError):
+            code.lr_solve('xyz', (0.1, 0.2), roots=3, max_subspace=10)
+
+    def test_lr_checkpoint(self, code):
+        self.skip_if_not_implemented('lr_solve', code)
+
+        checkpoint = os.path.join(code.get_workdir(), 'lr_checkpoint.npz')
+        code.lr_solve('z', (0.2,), maxit=2, checkpoint='lr_checkpoint.npz')
+        assert os.path.exists(checkpoint)
+        solutions, _ = code.lr_solve(
+            'z', (0.2,), checkpoint='lr_checkpoint.npz'
+        )
+        os.remove(checkpoint)
+        V, = code.get_rhs('z')
+        npt.assert_allclose(
+            -V@solutions[('z', 0.2)], -5.518828539302, atol=1e-4
+        )
+
+    @pytest.mark.parametrize('warm', ['guess', 'subspace'])
+    def test_lr_warm_start(self, code, warm, monkeypatch):
+        transformed = []
+        e2n = code.e2n
+
+        def counted(b):
+            transformed.append(np.shape(b)[1] if np.ndim(b) == 2 else 1)
+            return e2n(b)
+
+        monkeypatch.setattr(code, 'e2n', counted)
+        solutions, excitations = self.assert_lr_and_excitations(code)
+        cold = sum(transformed)
+
+        if warm == 'guess':
+            kwargs = {'guess': (solutions, excitations)}
+        else:
+            kwargs = {
+                'subspace': np.array([X for _, X in excitations]).T
+            }
+        transformed.clear()
+        self.assert_lr_and_excitations(code, **kwargs)
+        # a warm start needs fewer linear transformations
+        assert sum(transformed) < cold
+
+    def test_excitation_energies_guess(self, code):
+        self.skip_if_not_implemented('pp_solve', code)
+
+        excitations = code.pp_solve(3)
+        w = [w for w, _ in code.pp_solve(3, guess=({}, excitations))]
+        npt.assert_allclose(w, [0.34252829, 0.40843353, 0.43986599], atol=1e-5)
+
+    @pytest.mark.parametrize('name', ['bcgs2', 'cholqr2'])
+    def test_lr_normalizer(self, code, name):
+        code.set_normalizer(name)
+        lr = code.lr('z', 'z', (0.2,))
+        code.set_normalizer('bcgs2')
+        npt.assert_allclose(lr[('z', 'z', 0.2)], -5.518828539302, atol=1e-4)
+
+    def test_lr_checkpoint_no_iterations(self, code):
+        self.skip_if_not_implemented('lr_solve', code)
+
+        checkpoint = os.path.join(code.get_workdir(), 'lr_checkpoint.npz')
+        code.lr_solve('z', (0.2,), maxit=0, checkpoint='lr_checkpoint.npz')
+        assert os.path.exists(checkpoint)
+        os.remove(checkpoint)
+
+    def test_lr_out_of_core(self, code):
+        lr = code.lr('z', 'z', (0.2,), out_of_core=True)
+        npt.assert_allclose(lr[('z', 'z', 0.2)], -5.518828539302, atol=1e-4)
+
+    def test_lr_single_precision(self, code, monkeypatch):
+        stored = set()
+        add_sigmas = Subspace.add_sigmas
+
+        def spy(subspace, e2b, s2b):
+            add_sigmas(subspace, e2b, s2b)
+            stored.update((subspace.b.dtype, subspace.e2b.dtype))
+
+        monkeypatch.setattr(Subspace, 'add_sigmas', spy)
+        solutions, excitations = self.assert_lr_and_excitations(
+            code, single_precision=True
+        )
+        assert stored == {np.dtype(np.float32)}
+
+        # the residuals are converged in double precision
+        n = solutions[('z', 0.2)]
+        X = np.array([X for _, X in excitations]).T
+        e2n, s2n = code.sigmas(np.column_stack((n, X)))
+        V, = code.get_rhs('z')
+        r = e2n[:, 0] - 0.2*s2n[:, 0] - V
+        assert np.linalg.norm(r)/np.linalg.norm(n) < 1e-5
+        for k, (w, _) in enumerate(excitations, start=1):
+            r = e2n[:, k] - w*s2n[:, k]
+            assert np.linalg.norm(r)/np.linalg.norm(X[:, k - 1]) < 1e-5
+
     def test_excitation_energies(self, code):
         self.skip_if_not_implemented('excitation_energies', code)
 
         w = code.excitation_energies(3)
         npt.assert_allclose(w, [0.34252829, 0.40843353, 0.43986599], atol=1e-5)
 
+    def assert_lr_and_excitations(self, code, **kwargs):
+        """
+        Solve for the z response at 0.2 and the three lowest excitations,
+        check them and return them
+        """
+        self.skip_if_not_implemented('lr_solve', code)
+
+        solutions, excitations = code.lr_solve(
+            'z', (0.2,), roots=3, **kwargs
+        )
+        V, = code.get_rhs('z')
+        npt.assert_allclose(
+            -V@solutions[('z', 0.2)], -5.518828539302, atol=1e-4
+        )
+        w = [w for w, _ in excitations]
+        npt.assert_allclose(w, [0.34252829, 0.40843353, 0.43986599], atol=1e-5)
+        return solutions, excitations
+
+    def test_lr_and_excitations(self, code):
+        self.assert_lr_and_excitations(code)
+
+    def test_excitation_energies_paired(self, code):
+        self.skip_if_not_implemented('pp_solve', code)
+
+        w = [w for w, _ in code.pp_solve(3, paired=True)]
+        npt.assert_allclose(w, [0.34252829, 0.40843353, 0.43986599], atol=1e-5)
+
     @pytest.mark.parametrize(
         'args',
         [
@@ -181,3 +394,18 @@ class TestH2O(TestQC):
             Fmo[orbital, orbital],
             atol=1e-8
         )
+
+    def test_diis_errors(self, code):
+        code.set_scf_iterator(
+            'diis',
+            electrons=10,
+            max_iterations=4,
+            threshold=1e-10,
+            tmpdir=code.get_workdir(),
+            max_vecs=3,
+        )
+        for _ in code.scf:
+            pass
+        assert len(code.scf.evecs) == 3
+        E = np.array([e.ravel() for e in code.scf.evecs])
+        npt.assert_allclose(code.scf.errors, 4*E@E.T, atol=1e-12)
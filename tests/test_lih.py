@@ -241,6 +241,14 @@ class TestLiH(TestQC):
         assert w1 == pytest.approx(w2)
         npt.assert_allclose(X1, X2, atol=1e07)
 
+    def test_initial_excitation_degenerate(self, code):
+        calculated = code.initial_excitations(2)
+        w = [w for w, _ in calculated]
+        npt.assert_allclose(w, [0.35994304, 0.44601483, 0.44601483], atol=1e-5)
+        X = np.array([X for _, X in calculated])
+        npt.assert_allclose(X.sum(axis=0)[[4, 5, 6]], [1, 1, 1])
+        assert X.sum() == 3
+
     def test_excitation_energies(self, code):
         self.skip_if_not_implemented('excitation_energies', code)
 
@@ -0,0 +1,119 @@
+import numpy as np
+import numpy.testing as npt
+
+from qcifc.core import QuantumChemistry, swap
+from qcifc.subspace import Subspace
+
+
+class Model(QuantumChemistry):
+    """Explicit RPA matrices of eight excitations"""
+
+    def __init__(self, n=8, uncoupled=False):
+        rng = np.random.default_rng(1)
+        A = np.diag(np.linspace(1.0, 4.0, n)) + 0.05*rng.random((n, n))
+        A = (A + A.T)/2
+        B = 0.02*rng.random((n, n))
+        B = (B + B.T)/2
+        if uncoupled:
+            # with the x gradient along it the x response converges first
+            A[0, 1:] = A[1:, 0] = B[0, :] = B[:, 0] = 0
+        self.E2 = np.block([[A, B], [B, A]])
+        self.S2 = np.diag([2.0]*n + [-2.0]*n)
+        self.V = {'x': np.eye(n)[0], 'y': rng.random(n)}
+        self.observers = []
+        self.setup()
+
+    def get_overlap(self):
+        pass
+
+    def get_one_el_hamiltonian(self):
+        pass
+
+    def get_nuclear_repulsion(self):
+        pass
+
+    def get_orbital_diagonal(self, shift=0.0):
+        return self.E2.diagonal() + shift
+
+    def get_overlap_diagonal(self):
+        return self.S2.diagonal().copy()
+
+    def get_rhs(self, *ops):
+        return tuple(np.r_[self.V[op], -self.V[op]] for op in ops)
+
+    def e2n(self, b):
+        return self.E2@b
+
+    def s2n(self, b):
+        return self.S2@b
+
+
+class Recorder:
+    """
+    Reported values and convergence flags of each iteration, with the
+    number of reduced solutions combined so far
+    """
+
+    def __init__(self, combined):
+        self.combined = combined
+        self.rows = []
+        self.row = []
+
+    def update(self, items, converged=False, **kwargs):
+        if items and all(isinstance(i, float) for i in items):
+            self.row.append((list(items), converged))
+
+    def reset(self):
+        if self.row:
+            self.rows.append((self.row, len(self.combined)))
+            self.row = []
+
+
+def test_locked_solution(monkeypatch):
+    qc = Model(uncoupled=True)
+    combined = []
+    combine = Subspace.combine
+
+    def counted(self, x):
+        combined.append(x)
+        return combine(self, x)
+
+    monkeypatch.setattr(Subspace, 'combine', counted)
+    recorder = Recorder(combined)
+    qc.set_observer(recorder)
+
+    solutions, _ = qc.lr_solve('xy', (0,), threshold=1e-8)
+
+    rows = [row for row, _ in recorder.rows]
+    x_converged = [row[0][1] for row in rows]
+    first = x_converged.index(True)
+    assert first < len(rows) - 1
+    # the converged solution keeps its reported values
+    for row in rows[first:]:
+        assert row[0] == rows[first][0]
+    # and only solutions unconverged in the previous iteration are solved
+    solved = np.diff([0] + [n for _, n in recorder.rows])
+    assert list(solved) == [2] + [
+        sum(not c for _, c in row) for row in rows[:-1]
+    ]
+
+    V = dict(zip('xy', qc.get_rhs('x', 'y')))
+    for op in 'xy':
+        npt.assert_allclose(
+            solutions[(op, 0)], np.linalg.solve(qc.E2, V[op]),
+            rtol=1e-6, atol=1e-8
+        )
+
+
+def test_locked_eigenvector_deflated():
+    qc = Model()
+    (w, X), = qc.lr_solve('', (), roots=1, threshold=1e-10)[1]
+    s2X = qc.S2@X
+    excitations = qc.initial_excitations(3)[1:]
+    trials = qc.setup_trials(
+        {}, excitations, converged={0: False, 1: False},
+        renormalize=False, locked=[(X, s2X)]
+    )
+    assert trials.shape[1] == 4
+    npt.assert_allclose(X@qc.S2@trials, 0, atol=1e-12)
+    npt.assert_allclose(swap(X)@qc.S2@trials, 0, atol=1e-12)
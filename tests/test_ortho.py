@@ -6,7 +6,11 @@ from hypothesis import given
 from hypothesis.strategies import integers
 
 # from ortho import __version__
-from qcifc.normalizer import Lowdin, GramSchmidt, QR
+from qcifc.normalizer import (
+    Lowdin, GramSchmidt, QR, BlockGramSchmidt, CholeskyQR2
+)
+from qcifc.subspace import Subspace
+from qcifc.core import orthogonalizer
 
 
 # def test_version():
@@ -82,6 +86,14 @@ def test_gs(data):
     npt.assert_allclose(outdata.T@outdata, expected, atol=1e-10)
 
 
+def test_gs_input_unchanged():
+    normalizer = GramSchmidt()
+    basis = np.array([[3., 1.], [2., 2.]]).T
+    indata = basis.copy()
+    normalizer.normalize(basis)
+    npt.assert_allclose(basis, indata)
+
+
 @pytest.mark.parametrize(
     'data',
     [
@@ -203,3 +215,143 @@ def test_gspol(m, n, k):
     basis = _randomnk(m, n, k)
     outdata = normalizer.normalize(basis)
     npt.assert_allclose(outdata.T@outdata, np.eye(k), atol=1e-10)
+
+
+@pytest.mark.parametrize(
+    'data',
+    [
+        ([[1., 0., 0.]], [[1.]]),
+        ([[2., 0., 0.]], [[1.]]),
+        (
+            [[1., 0., 0.], [0., 1., 0.]],
+            np.eye(2)
+        ),
+        (
+            [[1., 0., 0.], [1., 0., 0.]],
+            np.eye(1)
+        ),
+        (
+            [[2., 0., 0.], [0., 0., 0.], [3., 0., 0.]],
+            np.eye(1)
+        ),
+    ]
+)
+def test_bcgs2(data):
+    normalizer = BlockGramSchmidt()
+    indata, expected = data
+    basis = np.array(indata).T
+    outdata = normalizer.normalize(basis)
+    npt.assert_allclose(outdata.T@outdata, expected, atol=1e-10)
+
+
+@pytest.mark.parametrize('k', [1, 3, 5])
+def test_bcgs2_rank(k):
+    normalizer = BlockGramSchmidt()
+    basis = _randomnk(100, 5, k)
+    outdata = normalizer.normalize(basis)
+    npt.assert_allclose(outdata.T@outdata, np.eye(k), atol=1e-12)
+
+
+@pytest.mark.parametrize('subspace', [False, True])
+def test_bcgs2_against_basis(subspace):
+    normalizer = BlockGramSchmidt()
+    b, _ = np.linalg.qr(np.random.random((100, 10)))
+    # nearly in the span of b, and one column exactly in it
+    basis = b@np.random.random((10, 4)) + 1e-2*np.random.random((100, 4))
+    basis = np.hstack((basis, b[:, :1]))
+    if subspace:
+        s = Subspace(100)
+        s.append(b, b, b)
+        b = s
+    outdata = normalizer.orthonormalize(basis, b)
+    assert outdata.shape == (100, 4)
+    npt.assert_allclose(outdata.T@outdata, np.eye(4), atol=1e-12)
+    if subspace:
+        b = b.b
+    npt.assert_allclose(b.T@outdata, 0, atol=1e-12)
+
+
+@pytest.mark.parametrize(
+    'data',
+    [
+        ([[1., 0., 0.]], [[1.]]),
+        ([[2., 0., 0.]], [[1.]]),
+        (
+            [[2., 0., 0.], [0., 2., 0.]],
+            np.eye(2)
+        ),
+        (
+            [[1., 0., 0.], [1., 0., 0.]],
+            np.eye(1)
+        ),
+        (
+            [[3., 1.], [2., 2.]],
+            np.eye(2)
+        ),
+    ]
+)
+def test_cholqr2(data):
+    normalizer = CholeskyQR2()
+    indata, expected = data
+    basis = np.array(indata).T
+    outdata = normalizer.normalize(basis)
+    npt.assert_allclose(outdata.T@outdata, expected, atol=1e-10)
+
+
+@pytest.mark.parametrize('condition', [1e3, 1e9, 1e15])
+def test_cholqr2_ill_conditioned(condition):
+    normalizer = CholeskyQR2(threshold=1e-40)
+    u, _ = np.linalg.qr(np.random.random((200, 20)))
+    v, _ = np.linalg.qr(np.random.random((20, 20)))
+    basis = u@np.diag(np.logspace(0, -np.log10(condition), 20))@v
+    outdata = normalizer.normalize(basis)
+    npt.assert_allclose(outdata.T@outdata, np.eye(20), atol=1e-12)
+
+
+def test_cholqr2_against_basis():
+    normalizer = CholeskyQR2()
+    b, _ = np.linalg.qr(np.random.random((100, 10)))
+    basis = np.hstack((np.random.random((100, 4)), b[:, :2]))
+    outdata = normalizer.orthonormalize(basis, b)
+    assert outdata.shape == (100, 4)
+    npt.assert_allclose(outdata.T@outdata, np.eye(4), atol=1e-12)
+    npt.assert_allclose(b.T@outdata, 0, atol=1e-12)
+
+
+@given(
+    integers(min_value=100, max_value=200),
+    integers(min_value=1, max_value=100),
+    integers(min_value=1, max_value=100)
+)
+def test_cholqr2hyp(m, n, k):
+    if n < k:
+        n, k = k, n
+    normalizer = CholeskyQR2()
+    basis = _randomnk(m, n, k)
+    outdata = normalizer.normalize(basis)
+    npt.assert_allclose(outdata.T@outdata, np.eye(k), atol=1e-10)
+
+
+@pytest.mark.parametrize('method', ['symmetric', 'canonical'])
+def test_orthogonalizer(method):
+    a = np.random.random((10, 6))
+    S = a.T@a
+    X = orthogonalizer(S, method)
+    npt.assert_allclose(X.T@S@X, np.eye(6), atol=1e-10)
+    npt.assert_allclose(X@X.T, np.linalg.inv(S), rtol=1e-6)
+    if method == 'symmetric':
+        npt.assert_allclose(X, X.T, atol=1e-10)
+
+
+@pytest.mark.parametrize('method', ['symmetric', 'canonical'])
+def test_orthogonalizer_lindep(method):
+    a = _randomnk(10, 6, 4)
+    S = a.T@a + 1e-12*np.eye(6)
+    X = orthogonalizer(S, method, threshold=1e-8)
+    assert X.shape == (6, 4)
+    npt.assert_allclose(X.T@S@X, np.eye(4), atol=1e-10)
+
+
+def test_orthogonalizer_unknown():
+    with pytest.raises(ValueError):
+        orthogonalizer(np.eye(2), 'cholesky')
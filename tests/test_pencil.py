@@ -0,0 +1,90 @@
+import numpy as np
+import numpy.testing as npt
+
+from qcifc.core import (
+    pencil, pencil_solve, pencil_roots, rpa_eigensolver,
+    paired_rpa_eigensolver, swap
+)
+
+
+def _pencil(n=4):
+    a = np.random.random((n, n))
+    b = 0.1*np.random.random((n, n))
+    A = a@a.T + n*np.eye(n)
+    B = b + b.T
+    E2 = np.block([[A, B], [B, A]])
+    S2 = np.diag([1.]*n + [-1.]*n)
+    return E2, S2
+
+
+def test_pencil_solve():
+    E2, S2 = _pencil()
+    V = np.random.random((8, 2))
+    freqs = (0, 0.5)
+    X = pencil_solve(*pencil(E2, S2), V, freqs)
+    for w, Xw in zip(freqs, X):
+        npt.assert_allclose((E2 - w*S2)@Xw, V, atol=1e-10)
+
+
+def test_pencil_roots():
+    E2, S2 = _pencil()
+    (w1, X1), (w2, X2) = pencil_roots(*pencil(E2, S2), 2)
+    assert 0 < w1 <= w2
+    for w, X in ((w1, X1), (w2, X2)):
+        npt.assert_allclose(E2@X, w*S2@X, atol=1e-10)
+        npt.assert_allclose(X@S2@X, 1)
+
+
+def test_pencil_not_definite():
+    E2, S2 = _pencil()
+    assert pencil(-E2, S2) is None
+
+
+def _lowest(E2, S2, n):
+    w = np.linalg.eigvals(np.linalg.solve(S2, E2)).real
+    return np.sort(w[w > 0])[:n]
+
+
+def test_rpa_eigensolver():
+    E2, S2 = _pencil()
+    # general S2 with antisymmetric Delta
+    d = 0.1*np.random.random((4, 4))
+    S2[:4, 4:] = d - d.T
+    S2[4:, :4] = d.T - d
+    wn, X = rpa_eigensolver(E2, S2, 2)
+    npt.assert_allclose(wn, _lowest(E2, S2, 2))
+    npt.assert_allclose(X.T@S2@X, np.eye(2), atol=1e-10)
+    npt.assert_allclose(E2@X, S2@X*wn, atol=1e-10)
+
+
+def test_rpa_eigensolver_no_states():
+    E2, S2 = _pencil()
+    wn, X = rpa_eigensolver(E2, S2, 0)
+    assert wn.shape == (0,)
+    assert X.shape == (8, 0)
+    parity = np.array([1]*4 + [-1]*4)
+    wn, X = paired_rpa_eigensolver(E2, S2, parity, 0)
+    assert X.shape == (8, 0)
+
+
+def test_rpa_eigensolver_unstructured():
+    E2, S2 = _pencil()
+    E2[0, 4] += 0.1
+    assert rpa_eigensolver(E2, S2, 2) is None
+
+
+def test_paired_rpa_eigensolver():
+    E2, S2 = _pencil()
+    # orthonormal gerade and ungerade basis vectors
+    z, _ = np.linalg.qr(np.random.random((4, 3)))
+    b = np.hstack((
+        np.vstack((z, z))[:, :2], np.vstack((z, -z))
+    ))/np.sqrt(2)
+    parity = np.array([1, 1, -1, -1, -1])
+    E2r, S2r = b.T@E2@b, b.T@S2@b
+    wn, x = paired_rpa_eigensolver(E2r, S2r, parity, 2)
+    assert 0 < wn[0] <= wn[1]
+    npt.assert_allclose(E2r@x, S2r@x*wn, atol=1e-10)
+    npt.assert_allclose(x.T@S2r@x, np.eye(2), atol=1e-10)
+    X = b@x
+    npt.assert_allclose(swap(X[:, 0]) @ S2 @ X[:, 0], 0, atol=1e-10)
@@ -0,0 +1,130 @@
+import numpy as np
+import numpy.testing as npt
+
+from qcifc.core import (
+    DiagonalPreconditioner, LevelShiftPreconditioner,
+    BlockDiagonalPreconditioner, TwoLevelPreconditioner
+)
+
+
+class Model:
+    """Two occupied and two virtual orbitals, non-canonical virtuals"""
+
+    F = np.array([
+        [-1.0, 0.0, 0.0, 0.0],
+        [0.0, -0.5, 0.0, 0.0],
+        [0.0, 0.0, 0.5, 0.1],
+        [0.0, 0.0, 0.1, 1.0],
+    ])
+
+    def get_excitations(self):
+        return [(0, 2), (0, 3), (1, 2), (1, 3)]
+
+    def get_mo_fock(self):
+        return self.F
+
+    def get_orbital_diagonal(self, shift=0.0):
+        od = [
+            2*(self.F[a, a] - self.F[i, i]) for i, a in self.get_excitations()
+        ]
+        return np.array(od + od) + shift
+
+    def get_overlap_diagonal(self):
+        return np.array([2.0]*4 + [-2.0]*4)
+
+    def _get_E2S2(self, excitations):
+        A = np.diag(self.get_orbital_diagonal()[:4]) + 0.1
+        B = 0.05*np.ones((4, 4))
+        E2 = np.block([[A, B], [B, A]])
+        S2 = np.diag(self.get_overlap_diagonal())
+        k = np.concatenate((excitations, np.add(excitations, 4)))
+        return E2[np.ix_(k, k)], S2[np.ix_(k, k)]
+
+
+def test_diagonal():
+    qc = Model()
+    v = np.random.random(8)
+    p = DiagonalPreconditioner(qc, shift=0)
+    npt.assert_allclose(
+        p(v, 0.5),
+        v/(qc.get_orbital_diagonal() - 0.5*qc.get_overlap_diagonal())
+    )
+
+
+def test_diagonal_cached():
+    p = DiagonalPreconditioner(Model())
+    p(np.ones(8), 0.5)
+    d = p._cache[('denominator', 0.5)]
+    p(np.ones(8), 0.5)
+    assert p._cache[('denominator', 0.5)] is d
+
+
+def test_cache_cleared():
+    p = DiagonalPreconditioner(Model())
+    for w in range(p.cache_size + 1):
+        p(np.ones(8), w)
+    assert len(p._cache) == 1
+
+
+def test_level_shift():
+    # denominator of excitation 0->2 is 3 - 2*1.5 = 0 at w = 1.5
+    p = LevelShiftPreconditioner(Model(), level_shift=0.1, shift=0)
+    t = p(np.ones(8), 1.5)
+    assert t[0] == 10
+    npt.assert_allclose(t[4], 1/6)
+
+
+def test_block_diagonal():
+    qc = Model()
+    p = BlockDiagonalPreconditioner(qc, shift=0)
+    w = 0.2
+    v = np.random.random(8)
+    F = qc.F
+    t = p(v, w)
+    for i, x, y in ((0, [0, 1], [4, 5]), (1, [2, 3], [6, 7])):
+        M = 2*(F[2:, 2:] - F[i, i]*np.eye(2))
+        npt.assert_allclose(t[x], np.linalg.solve(M - 2*w*np.eye(2), v[x]))
+        npt.assert_allclose(t[y], np.linalg.solve(M + 2*w*np.eye(2), v[y]))
+
+
+def test_block_diagonal_canonical():
+    qc = Model()
+    qc.F = np.diag(np.diag(Model.F))
+    v = np.random.random(8)
+    npt.assert_allclose(
+        BlockDiagonalPreconditioner(qc)(v, 0.3),
+        DiagonalPreconditioner(qc)(v, 0.3),
+    )
+
+
+def test_two_level_complete():
+    qc = Model()
+    p = TwoLevelPreconditioner(qc, size=4, shift=0)
+    E2, S2 = qc._get_E2S2(range(4))
+    v = np.random.random(8)
+    npt.assert_allclose(p(v, 0.3), np.linalg.solve(E2 - 0.3*S2, v))
+
+
+def test_two_level_model():
+    qc = Model()
+    p = TwoLevelPreconditioner(qc, size=1, shift=0)
+    # lowest diagonal for excitation 1->2
+    npt.assert_equal(p.model, [2, 6])
+    E2, S2 = qc._get_E2S2([2])
+    v = np.random.random(8)
+    t = p(v, 0.3)
+    npt.assert_allclose(t[p.model], np.linalg.solve(E2 - 0.3*S2, v[p.model]))
+    d = qc.get_orbital_diagonal() - 0.3*qc.get_overlap_diagonal()
+    rest = [0, 1, 3, 4, 5, 7]
+    npt.assert_allclose(t[rest], v[rest]/d[rest])
+
+
+def test_two_level_tda():
+    qc = Model()
+    p = TwoLevelPreconditioner(qc, size=4, tda=True, shift=0)
+    E2, S2 = qc._get_E2S2(range(4))
+    v = np.random.random(8)
+    t = p(v, 0.3)
+    A = E2[:4, :4]
+    npt.assert_allclose(t[:4], np.linalg.solve(A - 0.6*np.eye(4), v[:4]))
+    npt.assert_allclose(t[4:], np.linalg.solve(A + 0.6*np.eye(4), v[4:]))
@@ -0,0 +1,193 @@
+import numpy as np
+import numpy.testing as npt
+
+import qcifc.subspace
+from qcifc.subspace import Subspace
+
+
+def test_empty():
+    subspace = Subspace(4)
+    assert len(subspace) == 0
+    assert subspace.b.shape == (4, 0)
+
+
+def test_append():
+    subspace = Subspace(4, capacity=2)
+    b = np.random.random((4, 3))
+    subspace.append(b, 2*b, 3*b)
+    assert len(subspace) == 3
+    npt.assert_allclose(subspace.b, b)
+    npt.assert_allclose(subspace.e2b, 2*b)
+    npt.assert_allclose(subspace.s2b, 3*b)
+
+
+def test_capacity_doubles():
+    subspace = Subspace(4, capacity=2)
+    b = np.random.random((4, 3))
+    subspace.append(b[:, :2], b[:, :2], b[:, :2])
+    assert subspace.capacity == 2
+    subspace.append(b[:, 2:], b[:, 2:], b[:, 2:])
+    assert subspace.capacity == 4
+    npt.assert_allclose(subspace.b, b)
+
+
+def test_views():
+    subspace = Subspace(4)
+    b = np.random.random((4, 2))
+    subspace.append(b, b, b)
+    assert np.shares_memory(subspace.b, subspace._b)
+
+
+def test_reduced_matrices():
+    E2 = np.random.random((6, 6))
+    S2 = np.random.random((6, 6))
+    V = np.random.random(6)
+    b, _ = np.linalg.qr(np.random.random((6, 5)))
+    subspace = Subspace(6, capacity=2, rhs={'z': V})
+    subspace.append(b[:, :2], E2@b[:, :2], S2@b[:, :2])
+    subspace.append(b[:, 2:], E2@b[:, 2:], S2@b[:, 2:])
+    npt.assert_allclose(subspace.E2, b.T@E2@b)
+    npt.assert_allclose(subspace.S2, b.T@S2@b)
+    npt.assert_allclose(subspace.reduced_rhs('z'), b.T@V)
+
+
+def test_paired_blocks():
+    E2 = np.random.random((4, 4))
+    S2 = np.random.random((4, 4))
+    b = np.array([[1., 0., 1., 0.], [0., 1., 0., -1.]]).T/np.sqrt(2)
+    subspace = Subspace(4)
+    subspace.append(b, E2@b, S2@b, parity=[1, -1])
+    npt.assert_equal(subspace.parity, [1, -1])
+    assert subspace.E2[0, 1] == subspace.E2[1, 0] == 0
+    assert subspace.S2[0, 0] == subspace.S2[1, 1] == 0
+
+
+def test_collapse():
+    E2 = np.random.random((6, 6))
+    S2 = np.random.random((6, 6))
+    V = np.random.random(6)
+    b, _ = np.linalg.qr(np.random.random((6, 5)))
+    subspace = Subspace(6, rhs={'z': V})
+    subspace.append(b[:, :4], E2@b[:, :4], S2@b[:, :4])
+    subspace.append(b[:, 4:], E2@b[:, 4:], S2@b[:, 4:])
+    x = np.random.random(5)
+    subspace.collapse(x)
+    assert len(subspace) == 2
+    c = subspace.b
+    npt.assert_allclose(c.T@c, np.eye(2), atol=1e-12)
+    npt.assert_allclose(subspace.e2b, E2@c, atol=1e-12)
+    npt.assert_allclose(subspace.S2, c.T@S2@c, atol=1e-12)
+    npt.assert_allclose(subspace.reduced_rhs('z'), c.T@V, atol=1e-12)
+    # the collapsed space contains the vector and the latest trial
+    for v in (b@x, b[:, 4]):
+        npt.assert_allclose(c@c.T@v, v, atol=1e-12)
+
+
+def test_collapse_max_size():
+    E2 = np.random.random((8, 8))
+    S2 = np.random.random((8, 8))
+    b, _ = np.linalg.qr(np.random.random((8, 6)))
+    subspace = Subspace(8)
+    subspace.append(b[:, :5], E2@b[:, :5], S2@b[:, :5])
+    subspace.append(b[:, 5:], E2@b[:, 5:], S2@b[:, 5:])
+    x = np.random.random((6, 3))
+    subspace.collapse(x, max_size=2)
+    assert len(subspace) == 2
+    c = subspace.b
+    npt.assert_allclose(c.T@c, np.eye(2), atol=1e-12)
+    npt.assert_allclose(subspace.E2, c.T@E2@c, atol=1e-12)
+    # the first vectors have priority
+    for v in (b@x[:, 0], b@x[:, 1]):
+        npt.assert_allclose(c@c.T@v, v, atol=1e-12)
+
+
+def test_two_step_append():
+    E2 = np.random.random((6, 6))
+    S2 = np.random.random((6, 6))
+    b, _ = np.linalg.qr(np.random.random((6, 4)))
+    subspace = Subspace(6)
+    subspace.append(b[:, :2], E2@b[:, :2], S2@b[:, :2])
+    subspace.add_trials(b[:, 2:])
+    assert len(subspace) == 2
+    subspace.add_sigmas(E2@b[:, 2:], S2@b[:, 2:])
+    assert len(subspace) == 4
+    npt.assert_allclose(subspace.E2, b.T@E2@b)
+    npt.assert_allclose(subspace.S2, b.T@S2@b)
+
+
+def test_save_load(tmp_path):
+    E2 = np.random.random((6, 6))
+    S2 = np.random.random((6, 6))
+    V = np.random.random(6)
+    b, _ = np.linalg.qr(np.random.random((6, 3)))
+    subspace = Subspace(6)
+    subspace.append(b, E2@b, S2@b, parity=[1, -1, 1])
+    filename = str(tmp_path/'subspace.npz')
+    subspace.save(filename, extra=np.arange(3))
+    loaded, arrays = Subspace.load(filename, rhs={'z': V})
+    assert len(loaded) == 3
+    npt.assert_allclose(loaded.b, subspace.b)
+    npt.assert_allclose(loaded.e2b, subspace.e2b)
+    npt.assert_allclose(loaded.E2, subspace.E2)
+    npt.assert_allclose(loaded.S2, subspace.S2)
+    npt.assert_allclose(loaded.parity, [1, -1, 1])
+    npt.assert_allclose(loaded.reduced_rhs('z'), b.T@V)
+    npt.assert_allclose(arrays['extra'], range(3))
+
+
+def test_combine():
+    E2 = np.random.random((6, 6))
+    S2 = np.random.random((6, 6))
+    b, _ = np.linalg.qr(np.random.random((6, 3)))
+    subspace = Subspace(6)
+    subspace.append(b, E2@b, S2@b)
+    x = np.random.random(3)
+    n, e2n, s2n = subspace.combine(x)
+    npt.assert_allclose(n, b@x)
+    npt.assert_allclose(e2n, E2@b@x)
+    npt.assert_allclose(s2n, S2@b@x)
+
+
+def test_orthogonalize():
+    b, _ = np.linalg.qr(np.random.random((6, 3)))
+    subspace = Subspace(6)
+    subspace.append(b, b, b)
+    t = np.random.random((6, 2))
+    npt.assert_allclose(subspace.orthogonalize(t), t - b@b.T@t)
+
+
+def test_disk_storage(tmp_path, monkeypatch):
+    # panels of single columns and rows
+    monkeypatch.setattr(qcifc.subspace, 'PANEL_BYTES', 8)
+    E2 = np.random.random((6, 6))
+    S2 = np.random.random((6, 6))
+    V = np.random.random(6)
+    b, _ = np.linalg.qr(np.random.random((6, 5)))
+    subspace = Subspace(6, capacity=2, rhs={'z': V}, storage=str(tmp_path))
+    subspace.append(b[:, :3], E2@b[:, :3], S2@b[:, :3])
+    subspace.append(b[:, 3:], E2@b[:, 3:], S2@b[:, 3:])
+    assert isinstance(subspace.b, np.memmap)
+    # the files are released with the mappings
+    assert list(tmp_path.iterdir()) == []
+    npt.assert_allclose(subspace.E2, b.T@E2@b, atol=1e-12)
+    npt.assert_allclose(subspace.S2, b.T@S2@b, atol=1e-12)
+    npt.assert_allclose(subspace.reduced_rhs('z'), b.T@V, atol=1e-12)
+    x = np.random.random(5)
+    subspace.collapse(x)
+    c = subspace.b
+    npt.assert_allclose(c.T@c, np.eye(3), atol=1e-12)
+    npt.assert_allclose(subspace.s2b, S2@c, atol=1e-12)
+
+
+def test_single_precision():
+    E2 = np.random.random((6, 6))
+    S2 = np.random.random((6, 6))
+    b, _ = np.linalg.qr(np.random.random((6, 3)))
+    subspace = Subspace(6, dtype=np.float32)
+    subspace.append(b, E2@b, S2@b)
+    assert subspace.b.dtype == np.float32
+    assert subspace.E2.dtype == np.float64
+    npt.assert_allclose(subspace.E2, b.T@E2@b, atol=1e-6)
+    n, e2n, _ = subspace.combine(np.ones(3))
+    assert n.dtype == np.float64
+    npt.assert_allclose(e2n, E2@b@np.ones(3), atol=1e-6)
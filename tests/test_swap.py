@@ -1,6 +1,6 @@
 import numpy as np
 import numpy.testing as npt
-from qcifc.core import swap
+from qcifc.core import swap, parity
 
 
 def test_np():
@@ -17,3 +17,7 @@ def test_np2():
     assert x.shape == y.shape
     npt.assert_allclose(y, [[2., 1.], [1., 2.]])
 
+
+def test_parity():
+    x = np.array([[1., 1., 1.], [2., -2., 1.], [1., -1., 0.], [2., 2., 1.]])
+    npt.assert_equal(parity(x), [1, -1, 0])